@@ -0,0 +1,453 @@
+"""Benchmarks of paka.vx1 on synthetic blognets.
+
+Usage:
+
+    python benchmarks/bench.py generate --out-dir DIR [size options]
+    python benchmarks/bench.py run --history PATH [size options]
+    python benchmarks/bench.py compare --history PATH [--threshold 0.1]
+
+"run" generates blognet in temporary dir, times end-to-end build, its
+phases, views and steps (as reported by profiling of build) and
+microbenchmarks, appends results to JSON history. "compare" compares
+latest entry of history with baseline entry and exits with non-zero
+status if any benchmark is slower than baseline by more than threshold.
+
+"""
+import os
+import sys
+import json
+import time
+import random
+import functools
+import shutil
+import argparse
+import datetime
+import tempfile
+import subprocess
+import collections
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_NETWORK_DIR = os.path.join(
+    REPO_DIR, "tests", "files", "generator1", "source", "nets", "networks",
+    "samplenet")
+CURRENT_DATE = "2017-01-17"
+
+
+Sizes = collections.namedtuple(
+    "Sizes",
+    [
+        "networks", "sites", "notes", "tags", "series", "code_blocks",
+        "substatic"])
+
+
+# Generation of synthetic blognets.
+_WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua enim ad minim "
+    "veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea "
+    "commodo consequat").split()
+_CODE_BLOCK = """```python
+def {name}(items, key=None):
+    \"\"\"Sort {name} items.\"\"\"
+    result = sorted(items, key=key)
+    for n, item in enumerate(result):
+        print(n, item)
+    return result
+```"""
+_CHUNKS = {
+    "footer_copyrights": (
+        '<%namespace file="site_helpers.mako" name="helpers"/>\n'
+        '<p>© ${helpers.render_footer_years(site, separator=u"–")} '
+        '${helpers.render_site_name(site)}</p>'),
+    "primary_about": "<p>About ${site.attrs['name'] | h}.</p>"}
+for _code in (400, 403, 404, 413, 500):
+    _CHUNKS["error_page_{}_content".format(_code)] = (
+        "<p>Error {}.</p>".format(_code))
+
+
+def _write(path, contents):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(contents.encode("utf-8"))
+
+
+def _write_kv(path, pairs):
+    _write(
+        path, "".join("{}  {}\n".format(k, v) for k, v in pairs))
+
+
+def _words(rnd, count):
+    return " ".join(rnd.choice(_WORDS) for _ in range(count))
+
+
+def _make_body(rnd, sizes, n):
+    parts = []
+    for i in range(max(sizes.code_blocks, 1) * 2):
+        parts.append("## {}\n".format(_words(rnd, 4).capitalize()))
+        for _ in range(3):
+            parts.append(
+                "{} [link](http://example.com/{}) `code` *{}*.\n".format(
+                    _words(rnd, 40).capitalize(), i, _words(rnd, 2)))
+        if i % 2 == 0 and i // 2 < sizes.code_blocks:
+            parts.append(_CODE_BLOCK.format(name="func_{}_{}".format(n, i)))
+    return "\n".join(parts)
+
+
+def generate_blognets(out_dir, sizes, seed=0):
+    """Write synthetic blognets to out_dir (must not exist)."""
+    rnd = random.Random(seed)
+    networks_dir = os.path.join(out_dir, "networks")
+    sites_dir = os.path.join(out_dir, "sites")
+    start_date = datetime.date(2010, 1, 1)
+    for net_n in range(sizes.networks):
+        network_dir = os.path.join(networks_dir, "net{}".format(net_n))
+        sites_slugs = [
+            "net{}site{}".format(net_n, site_n)
+            for site_n in range(sizes.sites)]
+        _write(
+            os.path.join(network_dir, "sites-slugs"),
+            "\n".join(sites_slugs) + "\n")
+        for name in ("translations", "templates/header.html", "logo.xcf"):
+            os.makedirs(
+                os.path.dirname(os.path.join(network_dir, name)),
+                exist_ok=True)
+            shutil.copyfile(
+                os.path.join(FIXTURE_NETWORK_DIR, name),
+                os.path.join(network_dir, name))
+        for name, chunk in _CHUNKS.items():
+            _write(os.path.join(network_dir, "long_chunks", name), chunk)
+        _write(os.path.join(network_dir, "short_chunks"), "")
+        for site_slug in sites_slugs:
+            _generate_site(
+                os.path.join(sites_dir, site_slug), sizes=sizes, rnd=rnd,
+                start_date=start_date)
+
+
+def _generate_site(site_dir, sizes, rnd, start_date):
+    slug = os.path.basename(site_dir)
+    _write_kv(
+        os.path.join(site_dir, "attrs"),
+        [
+            ("name", slug), ("domain", "{}.example.com".format(slug)),
+            ("date_format", "{0:%B} {0.day}, {0:%Y}"), ("language", "en"),
+            ("description", _words(rnd, 10))])
+    os.makedirs(os.path.join(site_dir, "long_chunks"))
+    _write(os.path.join(site_dir, "short_chunks"), "")
+    notes_slugs = ["note-{}".format(n) for n in range(sizes.notes)]
+    tags_to_notes = collections.defaultdict(list)
+    series_to_notes = collections.defaultdict(list)
+    for n, note_slug in enumerate(notes_slugs):
+        date = start_date + datetime.timedelta(days=n)
+        note_dir = os.path.join(
+            site_dir, "notes", "{}-{}".format(date.isoformat(), note_slug))
+        _write_kv(
+            os.path.join(note_dir, "attrs"),
+            [("title", _words(rnd, 5).capitalize())])
+        _write(
+            os.path.join(note_dir, "body.md"),
+            _make_body(rnd, sizes=sizes, n=n))
+        for i in range(sizes.substatic):
+            _write(
+                os.path.join(note_dir, "substatic", "file{}.txt".format(i)),
+                _words(rnd, 100))
+        # Each note has at least one tag (required), popularity of tags
+        # is skewed.
+        tags_count = max(sizes.tags, 1)
+        for tag_n in {n % tags_count, int(rnd.paretovariate(1)) % tags_count}:
+            tags_to_notes["tag-{}".format(tag_n)].append(note_slug)
+        if sizes.series and n % 3 == 0:
+            series_to_notes["series-{}".format(n % sizes.series)].append(
+                note_slug)
+    for tag_slug, slugs in tags_to_notes.items():
+        tag_dir = os.path.join(site_dir, "tags", tag_slug)
+        _write_kv(
+            os.path.join(tag_dir, "attrs"),
+            [("name", tag_slug.capitalize())])
+        _write(os.path.join(tag_dir, "notes-slugs"), "\n".join(slugs))
+        _write(os.path.join(tag_dir, "description"), _words(rnd, 20))
+    for series_slug, slugs in series_to_notes.items():
+        series_dir = os.path.join(site_dir, "series", series_slug)
+        _write_kv(
+            os.path.join(series_dir, "attrs"),
+            [("name", series_slug.capitalize())])
+        _write(os.path.join(series_dir, "notes-slugs"), "\n".join(slugs))
+
+
+# Benchmarks.
+def _time_min_mean(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {
+        "min": min(times), "mean": sum(times) / len(times), "runs": repeat}
+
+
+def _make_main_argv(blognets_dir, work_dir, jobs):
+    return [
+        "--blognets-dir", blognets_dir, "--slug-pattern", "*",
+        "--build-dir", os.path.join(work_dir, "build"),
+        "--cache-dir", os.path.join(work_dir, "cache"),
+        "--current-date", CURRENT_DATE, "--jobs", str(jobs)]
+
+
+# Measurements of profiling report (see paka.vx1.profiling) that are
+# benchmarked as time per measured event.
+_PROFILED = (
+    ("phases", ("preparation", "static", "pages", "icons", "nginx")),
+    ("views", ("one_note", "one_tag", "all_notes", "recent_notes_feed")),
+    ("steps", ("mako_render", "htmlmin", "render_commonmark", "write")))
+
+
+def _time_profiled(argv, report_path, repeat):
+    """Run build with profiling, return results of profiled measurements."""
+    from paka.vx1 import generator
+
+    times = collections.defaultdict(list)
+    for _ in range(repeat):
+        generator.main(argv=argv + ["--profile-report", report_path])
+        with open(report_path, "rb") as file:
+            report = json.loads(file.read().decode("utf-8"))
+        for group, names in _PROFILED:
+            for name in names:
+                values = report[group].get(name)
+                if values:
+                    times["{}_{}".format(group, name)].append(
+                        values["wall"] / values["count"])
+    return {
+        name: {
+            "min": min(values), "mean": sum(values) / len(values),
+            "runs": len(values)}
+        for name, values in times.items()}
+
+
+class _RecordingRenderer(object):
+    """Renderer that records first call for each view."""
+
+    def __init__(self, renderer):
+        self._renderer = renderer
+        self.calls = {}
+
+    def __getattr__(self, name):
+        return getattr(self._renderer, name)
+
+    def render_to(self, file, template_name, **kwargs):
+        if "notes" in kwargs:
+            kwargs["notes"] = list(kwargs["notes"])
+        self.calls.setdefault(kwargs["view_name"], (template_name, kwargs))
+        self._renderer.render_to(file, template_name, **kwargs)
+
+
+def _time_parts(blognets_dir, work_dir, repeat):
+    """Return results of microbenchmarks of renderer, feeds and nginx.
+
+    First site is prepared and built with public functions of paka.vx1,
+    calls of renderer made by build are recorded and timed again.
+
+    """
+    from paka.vx1 import building, feeds, nginx, writing
+    from paka.vx1.features import make_feature_checker
+    from paka.vx1.generator import (
+        INTERNAL_TEMPLATES_DIR, error_callback, make_sites_specs)
+    from paka.vx1.preparation import prepare_sites
+    from paka.vx1.utils import subpaths
+
+    sites_dirs = sorted(subpaths(os.path.join(blognets_dir, "sites")))
+    sites = prepare_sites(
+        sites_dirs=sites_dirs,
+        networks_dir=os.path.join(blognets_dir, "networks"),
+        internal_templates_dir=INTERNAL_TEMPLATES_DIR,
+        prepended_templates_dirs=[], appended_templates_dirs=[],
+        current_date=datetime.datetime.strptime(
+            CURRENT_DATE, "%Y-%m-%d").date(),
+        error_callback=error_callback, attr_overrides=(),
+        slug_pattern=os.path.basename(sites_dirs[0]))
+    renderer = sites[0].renderer
+    recording_renderer = _RecordingRenderer(renderer)
+    build_dir = os.path.join(work_dir, "parts")
+    specs = make_sites_specs(
+        [sites[0]._replace(renderer=recording_renderer)], build_dir=build_dir)
+    writer = writing.make_writer(incremental=False)
+    building.build_site_by_spec(
+        specs[0], feature_checker=make_feature_checker(
+            ["about"], error_callback=error_callback),
+        writer=writer, graphs_dir=os.path.join(build_dir, "graphs"),
+        reuse_graphs=False, error_callback=error_callback)
+    results = {}
+    for view_name in ("one_note", "one_tag", "all_notes"):
+        template_name, kwargs = recording_renderer.calls[view_name]
+        results["renderer_call_{}".format(view_name)] = _time_min_mean(
+            functools.partial(renderer, template_name, **kwargs),
+            repeat=repeat * 10)
+    template_name, kwargs = recording_renderer.calls["all_notes"]
+    with open(os.devnull, "w", encoding="utf-8") as file:
+        results["renderer_render_to_all_notes"] = _time_min_mean(
+            functools.partial(
+                renderer.render_to, file, template_name, **kwargs),
+            repeat=repeat * 10)
+    feed_context = recording_renderer.calls["recent_notes_feed"][1]
+    results["make_notes_feed"] = _time_min_mean(
+        lambda: feeds.make_notes_feed(feed_context), repeat=repeat * 10)
+    results["build_nginx_config"] = _time_min_mean(
+        lambda: nginx.build_nginx_config(
+            specs, build_dir=build_dir, writer=writer),
+        repeat=repeat * 10)
+    return results
+
+
+def run_benchmarks(sizes, repeat, jobs, seed):
+    from paka.vx1 import generator
+    from paka.vx1.highlighting import render_commonmark
+
+    results = {}
+    temp_dir = tempfile.mkdtemp()
+    try:
+        blognets_dir = os.path.join(temp_dir, "blognets")
+        generate_blognets(blognets_dir, sizes=sizes, seed=seed)
+        work_dir = os.path.join(temp_dir, "work")
+        argv = _make_main_argv(blognets_dir, work_dir=work_dir, jobs=jobs)
+        generator.main(argv=argv)  # warm up (icons cache, imports)
+        results["main"] = _time_min_mean(
+            lambda: generator.main(argv=argv), repeat=repeat)
+        # Microbenchmarks (before profiled builds, which leave profiling
+        # on in this process).
+        body = _make_body(random.Random(seed), sizes=sizes, n=0)
+        results["render_commonmark"] = _time_min_mean(
+            lambda: render_commonmark(body), repeat=repeat * 10)
+        results.update(_time_parts(blognets_dir, work_dir, repeat=repeat))
+        # Phases, views and steps of build (measured by build itself, so
+        # benchmarks do not depend on internals of generator).
+        results.update(
+            _time_profiled(
+                argv, report_path=os.path.join(work_dir, "report.json"),
+                repeat=repeat))
+    finally:
+        shutil.rmtree(temp_dir)
+    return results
+
+
+def _get_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_DIR,
+            stderr=subprocess.DEVNULL).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _load_history(path):
+    try:
+        with open(path, "rb") as file:
+            return json.loads(file.read().decode("utf-8"))
+    except (IOError, OSError):
+        return []
+
+
+def _save_history(path, history):
+    with open(path, "wb") as file:
+        file.write(
+            json.dumps(history, indent=2, sort_keys=True).encode("utf-8"))
+
+
+def compare(baseline, current, threshold):
+    """Return list of (name, baseline time, current time) of regressions."""
+    regressions = []
+    for name, result in sorted(current["results"].items()):
+        try:
+            baseline_time = baseline["results"][name]["min"]
+        except KeyError:
+            continue
+        if result["min"] > baseline_time * (1 + threshold):
+            regressions.append((name, baseline_time, result["min"]))
+    return regressions
+
+
+def _add_sizes_arguments(parser):
+    defaults = Sizes(
+        networks=1, sites=2, notes=50, tags=10, series=3, code_blocks=2,
+        substatic=1)
+    for name, default in zip(Sizes._fields, defaults):
+        parser.add_argument(
+            "--{}".format(name.replace("_", "-")), type=int, default=default,
+            help="{} (default: %(default)s)".format(
+                {
+                    "networks": "number of networks",
+                    "sites": "number of sites per network",
+                    "notes": "number of notes per site",
+                    "tags": "number of tags per site",
+                    "series": "number of series per site",
+                    "code_blocks": "number of code blocks per note",
+                    "substatic": "number of substatic files per note"}[name]))
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def _get_sizes(args):
+    return Sizes(*(getattr(args, name) for name in Sizes._fields))
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(prog="bench.py")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    generate_parser = subparsers.add_parser(
+        "generate", help="write synthetic blognets to dir")
+    generate_parser.add_argument("--out-dir", required=True)
+    _add_sizes_arguments(generate_parser)
+    run_parser = subparsers.add_parser(
+        "run", help="run benchmarks, append results to history")
+    run_parser.add_argument("--history", required=True)
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--jobs", type=int, default=1)
+    _add_sizes_arguments(run_parser)
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare latest results with baseline")
+    compare_parser.add_argument("--history", required=True)
+    compare_parser.add_argument(
+        "--baseline", type=int, default=-2,
+        help="index of baseline entry in history (default: previous one)")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.1,
+        help="allowed slowdown, fraction of baseline (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        generate_blognets(
+            os.path.abspath(args.out_dir), sizes=_get_sizes(args),
+            seed=args.seed)
+    elif args.command == "run":
+        sizes = _get_sizes(args)
+        results = run_benchmarks(
+            sizes, repeat=args.repeat, jobs=args.jobs, seed=args.seed)
+        history = _load_history(args.history)
+        history.append({
+            "date": datetime.datetime.utcnow().isoformat(),
+            "commit": _get_commit(),
+            "python": sys.version.split()[0],
+            "sizes": sizes._asdict(),
+            "jobs": args.jobs,
+            "results": results})
+        _save_history(args.history, history)
+        for name, result in sorted(results.items()):
+            print("{:<32} {:.6f}s".format(name, result["min"]))
+    elif args.command == "compare":
+        history = _load_history(args.history)
+        if len(history) < 2:
+            parser.error("history needs at least two entries")
+        baseline, current = history[args.baseline], history[-1]
+        if baseline["sizes"] != current["sizes"]:
+            print("warning: sizes of blognets differ", file=sys.stderr)
+        regressions = compare(baseline, current, threshold=args.threshold)
+        for name, baseline_time, current_time in regressions:
+            print(
+                "{:<32} {:.6f}s -> {:.6f}s ({:+.1%})".format(
+                    name, baseline_time, current_time,
+                    current_time / baseline_time - 1))
+        if regressions:
+            sys.exit(1)
+        print("no regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import os
 import shutil
+import functools
 import collections
 
 from paka import breadcrumbs
@@ -9,7 +10,10 @@ from . import errorpages
 from . import routing
 from . import consts
 from . import features
-from . import utils
+from . import parallel
+from . import static
+from . import dependencies
+from . import profiling
 
 
 REQUIRED_CHUNK_NAMES = [
@@ -21,32 +25,70 @@ for code in errorpages.CODES:
             "error_page_{}_content".format(code)])
 
 
+# render of page spec (if not None) is function that writes rendered page
+# to text file.
 _PageSpec = collections.namedtuple(
-    "_PageSpec", ["dest_path", "src_path", "contents"])
+    "_PageSpec", ["dest_path", "src_path", "render"])
+# Page of paginated list of notes (number starts from 1, url_paths are
+# URL paths of all pages of list).
+_Page = collections.namedtuple("_Page", ["number", "url_paths"])
 
 
-def prepare_build_dir(build_dir):
-    try:
-        shutil.rmtree(build_dir, ignore_errors=False)
-    except (OSError, IOError):
-        pass
-    os.makedirs(build_dir)
+def prepare_build_dir(build_dir, keep=False):
+    if not keep:
+        try:
+            shutil.rmtree(build_dir, ignore_errors=False)
+        except (OSError, IOError):
+            pass
+    os.makedirs(build_dir, exist_ok=keep)
 
 
-def _make_chunks(site, context, required_chunk_names, error_callback):
-    def _make_chunk_renderer(chunk_template, context):
+def _make_site_chunks(
+        site, site_context, required_chunk_names, error_callback):
+    """Return mapping {chunk name: (chunk template, renderer or None)}.
+
+    Chunks that render with site_context alone (without page-specific
+    names) are rendered here once, and their renderers return result;
+    renderer of other chunks is None (they are rendered for each page,
+    see _make_chunks).
+
+    """
+    def _make_rendered_chunk(rendered):
         def _render_chunk():
-            return site.renderer.render_text(chunk_template, **context)
+            return rendered
         return _render_chunk
+
     chunks_data = dict(site.network.chunks_data, **site.chunks_data)
-    chunks = {}
-    for chunk_name, chunk_template in chunks_data.items():
-        chunks[chunk_name] = _make_chunk_renderer(chunk_template, context)
     for chunk_name in required_chunk_names:
-        if chunk_name not in chunks:
+        if chunk_name not in chunks_data:
             error_callback(
                 "{!r} chunk does not exist for {} site!".format(
                     chunk_name, site.slug))
+    site_chunks = {}
+    for chunk_name, chunk_template in chunks_data.items():
+        try:
+            rendered = site.renderer.render_text_strict(
+                chunk_template, **site_context)
+        except Exception:
+            # Chunk needs page context (e.g. missing name or chunks of
+            # page); if it is broken, error is raised when page renders it.
+            site_chunks[chunk_name] = (chunk_template, None)
+        else:
+            site_chunks[chunk_name] = (
+                chunk_template, _make_rendered_chunk(rendered))
+    return site_chunks
+
+
+def _make_chunks(site, site_chunks, context):
+    def _make_chunk_renderer(chunk_template, context):
+        def _render_chunk():
+            return site.renderer.render_text(chunk_template, **context)
+        return _render_chunk
+    chunks = {}
+    for chunk_name, (chunk_template, chunk_renderer) in site_chunks.items():
+        if chunk_renderer is None:
+            chunk_renderer = _make_chunk_renderer(chunk_template, context)
+        chunks[chunk_name] = chunk_renderer
     return chunks
 
 
@@ -84,14 +126,21 @@ def _make_breadcrumbs(current_route, context, site):
 
 def _make_page_spec_factory(
         routes_map, site, pages_build_dir, required_chunk_names,
-        extra_template_context, error_callback):
+        extra_template_context, graph, error_callback):
+    site_chunks = _make_site_chunks(
+        site,
+        site_context=dict(
+            extra_template_context, site=site, routes_map=routes_map),
+        required_chunk_names=required_chunk_names,
+        error_callback=error_callback)
+
     def _make_fs_path(url_path, fmt):
         segments = [] if url_path == "/" else url_path.lstrip("/").split("/")
         if fmt is not routing.Fmt.direct:
             segments.append("index.{}".format(fmt.value))
         return os.path.join(pages_build_dir, *segments)
 
-    def _make_page_spec(view_name, context, substatic=False):
+    def _make_page_spec(view_name, context, deps=(), substatic=False):
         route = routes_map.find_route_by_view_name(view_name, touch=True)
         url_path = routes_map.format_url_path(
             route.view_name, context=context)
@@ -104,9 +153,13 @@ def _make_page_spec_factory(
                 _PageSpec(
                     src_path=os.path.join(src_root, suffix),
                     dest_path=os.path.join(dest_root, suffix),
-                    contents=None)
+                    render=None)
                 for suffix in suffixes)
         else:
+            path = _make_fs_path(url_path, fmt=route.fmt)
+            if graph.add(path, deps):
+                # Page was built from same inputs, so keep it as is.
+                return _PageSpec(dest_path=path, render=None, src_path=None)
             # Add always-present (in templates) items.
             context = dict(
                 context, view_name=view_name, url_path=url_path, site=site,
@@ -117,29 +170,26 @@ def _make_page_spec_factory(
                 breadcrumbs=_make_breadcrumbs(
                     route, context=context, site=site),
                 chunks=_make_chunks(
-                    site, context=context,
-                    required_chunk_names=required_chunk_names,
-                    error_callback=error_callback))
-            # Now make page spec.
-            contents = site.renderer(route.template_name, **context)
-            path = _make_fs_path(url_path, fmt=route.fmt)
-            return _PageSpec(dest_path=path, contents=contents, src_path=None)
+                    site, site_chunks=site_chunks, context=context))
+            # Now make page spec (page is rendered straight to file, so
+            # big pages are not kept in memory).
 
-    return _make_page_spec
+            def _render(file):
+                with profiling.measure(profiling.VIEWS, view_name):
+                    site.renderer.render_to(
+                        file, route.template_name, **context)
 
+            return _PageSpec(dest_path=path, render=_render, src_path=None)
 
-def _make_extra_template_context(site):
-    recent_notes = utils.sort_notes(site.notes)[:10]
+    return _make_page_spec
 
-    def popular_tags_sorting_key(tag):
-        return (
-            -len(tag.notes_slugs), utils.tag_sorting_key(tag))
 
-    popular_tags = sorted(
-        site.tags.values(), key=popular_tags_sorting_key)[:10]
+def _make_extra_template_context(site, static_url_paths):
     return {
-        consts.RECENT_NOTES_TEMPLATE_CONTEXT_KEY: recent_notes,
-        consts.POPULAR_TAGS_TEMPLATE_CONTEXT_KEY: popular_tags}
+        consts.RECENT_NOTES_TEMPLATE_CONTEXT_KEY: site.index.sorted_notes[:10],
+        consts.POPULAR_TAGS_TEMPLATE_CONTEXT_KEY: site.index.popular_tags[:10],
+        consts.STATIC_URL_PATHS_TEMPLATE_CONTEXT_KEY: (
+            static_url_paths or static.DEFAULT_URL_PATHS)}
 
 
 def _make_note_pairs_for_feed(notes, routes_map):
@@ -149,9 +199,43 @@ def _make_note_pairs_for_feed(notes, routes_map):
         yield (note, note_path)
 
 
+def _paginate(
+        mk, routes_map, view_name, page_view_name, context, notes,
+        notes_per_page, make_deps):
+    """Yield page specs of list of notes.
+
+    If notes_per_page is None, all notes are listed on one page (and page
+    is None in context), otherwise first page is at URL of view_name and
+    next ones are at URLs of page_view_name.
+
+    """
+    if notes_per_page is None:
+        yield mk(
+            view_name=view_name, context=dict(context, notes=notes, page=None),
+            deps=make_deps(notes))
+        return
+    notes_pages = [
+        notes[start:start + notes_per_page]
+        for start in range(0, len(notes), notes_per_page)] or [notes]
+    url_paths = tuple(
+        routes_map.format_url_path(
+            view_name if number == 1 else page_view_name,
+            context=dict(context, page_number=number))
+        for number in range(1, len(notes_pages) + 1))
+    # Route of next pages is in use even if list fits on first page.
+    routes_map.find_route_by_view_name(page_view_name, touch=True)
+    for number, page_notes in enumerate(notes_pages, 1):
+        yield mk(
+            view_name=view_name if number == 1 else page_view_name,
+            context=dict(
+                context, notes=page_notes, page_number=number,
+                page=_Page(number=number, url_paths=url_paths)),
+            deps=make_deps(page_notes))
+
+
 def _generate_pages_specs(
-        site, pages_build_dir, required_chunk_names, feature_checker,
-        error_callback):
+        site, pages_build_dir, required_chunk_names, feature_checker, graph,
+        error_callback, notes_per_page=None, static_url_paths=None):
     routes_map = routing.Map(error_callback=error_callback)
     routing.add_routes(routes_map, feature_checker=feature_checker)
     routes_map.check_routes()
@@ -159,11 +243,12 @@ def _generate_pages_specs(
         routes_map=routes_map, site=site,
         pages_build_dir=pages_build_dir,
         required_chunk_names=required_chunk_names,
-        extra_template_context=_make_extra_template_context(site),
-        error_callback=error_callback)
+        extra_template_context=_make_extra_template_context(
+            site, static_url_paths=static_url_paths),
+        graph=graph, error_callback=error_callback)
+    index = site.index
     for tag in site.tags.values():
-        notes = utils.sort_notes(
-            note for note in site.notes if tag.slug in note.tags_slugs)
+        notes = index.tag_to_notes[tag.slug]
         yield mk(
             view_name="recent_tag_notes_feed",
             context={
@@ -172,40 +257,59 @@ def _generate_pages_specs(
                 "notes": _make_note_pairs_for_feed(
                     notes[:10], routes_map=routes_map),
                 "link_path": routes_map.format_url_path(
-                    "one_tag", context={"tag": tag})})
-        yield mk(
-            view_name="one_tag",
-            context={"tag": tag, "notes": notes})
+                    "one_tag", context={"tag": tag})},
+            deps=[dependencies.tag_key(tag)] + [
+                dependencies.note_key(note) for note in notes[:10]])
+        yield from _paginate(
+            mk, routes_map=routes_map, view_name="one_tag",
+            page_view_name="one_tag_page", context={"tag": tag},
+            notes=notes, notes_per_page=notes_per_page,
+            make_deps=lambda notes, tag=tag: (
+                [dependencies.tag_key(tag)] + [
+                    dependencies.note_meta_key(note) for note in notes]))
     yield mk(
         view_name="all_tags",
-        context={"tags": utils.sort_tags(site.tags.values())})
+        context={"tags": index.sorted_tags},
+        deps=[dependencies.tag_meta_key(tag) for tag in site.tags.values()])
     for note in site.notes:
-        tags = [site.tags[slug] for slug in note.tags_slugs]
+        tags = index.note_to_tags[note.slug]
         series = [site.series[slug] for slug in note.series_slugs]
         series_to_notes = {
-            s.slug: utils.sort_notes([
-                note for note in site.notes if s.slug in note.series_slugs])
-            for s in series}
+            s.slug: index.series_to_notes[s.slug] for s in series}
         context = {
             "note": note,
-            "tags": utils.sort_tags(tags),
+            "tags": tags,
             "series": _sorted_series(series),
             "series_to_notes": series_to_notes}
         view_name = "one_note"
-        yield mk(view_name=view_name, context=context)
+        yield mk(
+            view_name=view_name, context=context,
+            deps=(
+                [dependencies.note_key(note)] +
+                [dependencies.tag_meta_key(tag) for tag in tags] +
+                [dependencies.series_key(s) for s in series] +
+                [
+                    dependencies.note_meta_key(n)
+                    for notes in series_to_notes.values() for n in notes]))
         yield from mk(
             view_name=view_name, context=dict(context, substatic_object=note),
             substatic=True)
+    feed_notes = index.sorted_notes[:10]
     yield mk(
         view_name="recent_notes_feed",
         context={
             "notes": _make_note_pairs_for_feed(
-                utils.sort_notes(site.notes)[:10], routes_map=routes_map),
+                feed_notes, routes_map=routes_map),
             "is_tag_view": False,
-            "link_path": routes_map.format_url_path("all_notes", context={})})
-    yield mk(
-        view_name="all_notes",
-        context={"notes": utils.sort_notes(site.notes)})
+            "link_path": routes_map.format_url_path("all_notes", context={})},
+        deps=[dependencies.note_key(note) for note in feed_notes])
+    yield from _paginate(
+        mk, routes_map=routes_map, view_name="all_notes",
+        page_view_name="all_notes_page", context={},
+        notes=index.sorted_notes, notes_per_page=notes_per_page,
+        make_deps=lambda notes: (
+            [dependencies.NOTES_KEY] +
+            [dependencies.note_meta_key(note) for note in notes]))
     if feature_checker(features.Feature.about):
         yield mk(view_name="about", context={})
     yield mk(view_name="home", context={})
@@ -216,19 +320,80 @@ def _generate_pages_specs(
     routes_map.check_for_untouched_routes()
 
 
-def build_site_by_spec(site_spec, feature_checker, error_callback):
+def build_site_by_spec(
+        site_spec, feature_checker, writer, graphs_dir, reuse_graphs,
+        error_callback, notes_per_page=None):
+    """Build pages of site, return paths of written (or kept) files.
+
+    Graph of inputs used by pages is saved to graphs_dir. If reuse_graphs
+    is true, pages whose inputs did not change since previous build are
+    not rendered (and are kept as is). If notes_per_page is passed
+    (pagination feature must be on), lists of notes are paginated.
+
+    """
+    site = site_spec.site
+    with profiling.measure(profiling.SITES, site.slug):
+        with profiling.dump_profile(site.slug):
+            return _build_site_by_spec(
+                site_spec, feature_checker=feature_checker, writer=writer,
+                graphs_dir=graphs_dir, reuse_graphs=reuse_graphs,
+                error_callback=error_callback, notes_per_page=notes_per_page)
+
+
+def _build_site_by_spec(
+        site_spec, feature_checker, writer, graphs_dir, reuse_graphs,
+        error_callback, notes_per_page):
+    site = site_spec.site
+    extra_template_context = _make_extra_template_context(
+        site, static_url_paths=site_spec.static_url_paths)
+    graph = dependencies.load_graph(
+        os.path.join(graphs_dir, "{}.json".format(site.slug)),
+        inputs=dependencies.get_inputs(
+            site, feature_checker=feature_checker,
+            recent_notes=extra_template_context[
+                consts.RECENT_NOTES_TEMPLATE_CONTEXT_KEY],
+            popular_tags=extra_template_context[
+                consts.POPULAR_TAGS_TEMPLATE_CONTEXT_KEY],
+            static_url_paths=extra_template_context[
+                consts.STATIC_URL_PATHS_TEMPLATE_CONTEXT_KEY],
+            notes_per_page=notes_per_page, precompress=writer.precompress),
+        reuse=reuse_graphs)
+    paths = []
     for page_spec in _generate_pages_specs(
-            site=site_spec.site,
+            site=site,
             pages_build_dir=site_spec.pages_build_dir,
             required_chunk_names=REQUIRED_CHUNK_NAMES,
-            feature_checker=feature_checker,
-            error_callback=error_callback):
+            feature_checker=feature_checker, graph=graph,
+            error_callback=error_callback, notes_per_page=notes_per_page,
+            static_url_paths=site_spec.static_url_paths):
         src_path = page_spec.src_path
         dest_path = page_spec.dest_path
-        contents = page_spec.contents
-        assert contents is not None or src_path
-        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-        if contents is not None:
-            utils.write_file(dest_path, contents)
+        render = page_spec.render
+        if render is not None:
+            # Writer measures writing of page (not its rendering).
+            with writer.open(dest_path) as file:
+                render(file)
+            paths.append(dest_path)
+        elif src_path:
+            with profiling.measure(profiling.STEPS, "write"):
+                paths.append(writer.copy(src_path, dest_path))
         else:
-            shutil.copyfile(src_path, dest_path)
+            paths.append(dest_path)
+    # Graph must not list pages that are not written yet.
+    with profiling.measure(profiling.STEPS, "write"):
+        writer.flush()
+    graph.save()
+    return paths
+
+
+def build_sites_by_specs(
+        specs, feature_checker, writer, graphs_dir, reuse_graphs,
+        error_callback, jobs=1, notes_per_page=None):
+    results = parallel.run(
+        functools.partial(
+            build_site_by_spec, feature_checker=feature_checker,
+            writer=writer, graphs_dir=graphs_dir, reuse_graphs=reuse_graphs,
+            notes_per_page=notes_per_page),
+        specs, jobs=jobs, error_callback=error_callback,
+        get_label=lambda spec: spec.site.slug)
+    return [path for paths in results for path in paths]
@@ -0,0 +1,82 @@
+import os
+import hashlib
+
+from . import consts
+from . import profiling
+
+
+def make_key(*parts):
+    """Return key (hex digest) of strings (or bytes in CHARSET)."""
+    h = hashlib.sha1()
+    for part in parts:
+        data = part if isinstance(part, bytes) else part.encode(
+            consts.CHARSET)
+        h.update("{}:".format(len(data)).encode("ascii"))
+        h.update(data)
+    return h.hexdigest()
+
+
+def make_cache(cache_dir, name, max_size):
+    """Make persistent cache of strings in <cache_dir>/<name>.
+
+    Hits and misses are counted (see profiling) as <name>_hits and
+    <name>_misses.
+
+    """
+    return _Cache(os.path.join(cache_dir, name), name=name, max_size=max_size)
+
+
+class _Cache(object):
+    """Cache that stores each value in file named after key.
+
+    Files are touched on hit, so evict removes least recently used ones.
+    Cache may be shared by several processes.
+
+    """
+
+    def __init__(self, cache_dir, name, max_size):
+        self._cache_dir = cache_dir
+        self._name = name
+        self._max_size = max_size
+
+    def _make_path(self, key):
+        return os.path.join(self._cache_dir, key[:2], key)
+
+    def get(self, key):
+        """Return cached value (or None)."""
+        path = self._make_path(key)
+        try:
+            with open(path, "rb") as file:
+                value = file.read().decode(consts.CHARSET)
+            os.utime(path)
+        except (IOError, OSError):
+            profiling.count("{}_misses".format(self._name))
+            return None
+        profiling.count("{}_hits".format(self._name))
+        return value
+
+    def set(self, key, value):
+        path = self._make_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path, "wb") as file:
+            file.write(value.encode(consts.CHARSET))
+        os.replace(temp_path, path)
+
+    def evict(self):
+        """Remove least recently used values until size fits max size."""
+        entries = []
+        try:
+            subdirs = os.listdir(self._cache_dir)
+        except (IOError, OSError):  # nothing was cached yet
+            return
+        for subdir in subdirs:
+            for entry in os.scandir(os.path.join(self._cache_dir, subdir)):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self._max_size:
+                break
+            os.remove(path)
+            size -= entry_size
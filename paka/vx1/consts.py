@@ -3,3 +3,4 @@ CHARSET = "utf-8"
 
 RECENT_NOTES_TEMPLATE_CONTEXT_KEY = "recent_notes"
 POPULAR_TAGS_TEMPLATE_CONTEXT_KEY = "popular_tags"
+STATIC_URL_PATHS_TEMPLATE_CONTEXT_KEY = "static_url_paths"
@@ -0,0 +1,201 @@
+import os
+import json
+import hashlib
+import datetime
+import functools
+import importlib
+
+import mako
+
+from . import features
+from . import rendering
+
+
+# Keys of inputs every page depends on (as they are used by base templates
+# or are present in context of every page).
+COMMON_KEYS = (
+    "code", "site", "network", "features", "translations", "chunks",
+    "templates", "recent_notes", "popular_tags", "static")
+
+# Key of set of notes of site (lists of notes depend on it, e.g. number of
+# their pages).
+NOTES_KEY = "notes"
+
+
+def note_key(note):
+    return "note:{}".format(note.slug)
+
+
+def note_meta_key(note):
+    """Return key of note's data that is shown in lists of notes."""
+    return "note_meta:{}".format(note.slug)
+
+
+def tag_key(tag):
+    return "tag:{}".format(tag.slug)
+
+
+def tag_meta_key(tag):
+    """Return key of tag's data that is shown in lists of tags."""
+    return "tag_meta:{}".format(tag.slug)
+
+
+def series_key(series):
+    return "series:{}".format(series.slug)
+
+
+def _json_default(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, rendering.LazyMarkdown):
+        return value.get_key()
+    raise TypeError(repr(value))
+
+
+def _fingerprint(*values):
+    dumped = json.dumps(values, sort_keys=True, default=_json_default)
+    return hashlib.sha1(dumped.encode("utf-8")).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _get_dir_fingerprint(path):
+    h = hashlib.sha1()
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            file_path = os.path.join(dirpath, filename)
+            h.update(os.path.relpath(file_path, path).encode("utf-8"))
+            with open(file_path, "rb") as file:
+                h.update(hashlib.sha1(file.read()).digest())
+    return h.hexdigest()
+
+
+# Packages whose code renders or minifies pages (paka.cmark and Pygments
+# only render Markdown, which is part of inputs as rendered HTML or its key).
+_CODE_PACKAGES = (
+    "paka.vx1", "paka.webstatic", "paka.feedgenerator", "paka.breadcrumbs")
+
+
+@functools.lru_cache(maxsize=None)
+def _get_code_fingerprint():
+    # Sources are hashed, as these packages have no version attributes.
+    h = hashlib.sha1(mako.__version__.encode("utf-8"))
+    for package_name in _CODE_PACKAGES:
+        package = importlib.import_module(package_name)
+        code_dir = os.path.dirname(os.path.abspath(package.__file__))
+        for dirpath, dirnames, filenames in os.walk(code_dir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(".py"):
+                    with open(os.path.join(dirpath, filename), "rb") as file:
+                        h.update(hashlib.sha1(file.read()).digest())
+    return h.hexdigest()
+
+
+def clear_cache():
+    """Forget fingerprints of dirs (needed if files in them changed)."""
+    _get_dir_fingerprint.cache_clear()
+
+
+def get_inputs(
+        site, feature_checker, recent_notes, popular_tags,
+        static_url_paths=None, notes_per_page=None, precompress=False):
+    """Return mapping {input key: fingerprint} for site.
+
+    Precompression is input too, as precompressed siblings of pages are
+    made only when pages are written.
+
+    """
+    def _note_meta(note):
+        return (note.slug, note.date, note.attrs)
+
+    inputs = {
+        "code": _get_code_fingerprint(),
+        "site": _fingerprint(
+            site.slug, site.attrs, site.earliest_year, site.current_year),
+        "network": _fingerprint(
+            site.network.slug,
+            [(s.slug, s.attrs) for s in site.network.sites]),
+        "features": _fingerprint(
+            [f.name for f in features.Feature if feature_checker(f)],
+            notes_per_page, precompress),
+        "translations": _fingerprint(
+            site.network.translations_data, site.translations_data),
+        "chunks": _fingerprint(site.network.chunks_data, site.chunks_data),
+        "templates": _fingerprint(
+            [
+                (path, _get_dir_fingerprint(path))
+                for path in site.renderer.directories],
+            site.renderer.minify_fragments),
+        "recent_notes": _fingerprint([_note_meta(n) for n in recent_notes]),
+        "popular_tags": _fingerprint(
+            [(t.slug, t.attrs, len(t.notes_slugs)) for t in popular_tags]),
+        "static": _fingerprint(static_url_paths),
+        NOTES_KEY: _fingerprint([note.slug for note in site.notes])}
+    for note in site.notes:
+        inputs[note_key(note)] = _fingerprint(
+            _note_meta(note), note.body, note.tags_slugs, note.series_slugs)
+        inputs[note_meta_key(note)] = _fingerprint(_note_meta(note))
+    for tag in site.tags.values():
+        inputs[tag_key(tag)] = _fingerprint(
+            tag.slug, tag.attrs, tag.description, tag.notes_slugs)
+        inputs[tag_meta_key(tag)] = _fingerprint(tag.slug, tag.attrs)
+    for series in site.series.values():
+        inputs[series_key(series)] = _fingerprint(
+            series.slug, series.attrs, series.description,
+            series.notes_slugs)
+    return inputs
+
+
+def load_graph(path, inputs, reuse):
+    """Load graph {page path: keys of inputs used by page}.
+
+    If reuse is false, previous graph is not loaded, so all pages are
+    considered outdated.
+
+    """
+    previous = {"inputs": {}, "pages": {}}
+    if reuse:
+        try:
+            with open(path, "rb") as file:
+                previous = json.loads(file.read().decode("utf-8"))
+        except (IOError, OSError, ValueError):
+            pass
+    return _Graph(path, inputs=inputs, previous=previous)
+
+
+class _Graph(object):
+
+    def __init__(self, path, inputs, previous):
+        self._path = path
+        self._inputs = inputs
+        self._previous_inputs = previous["inputs"]
+        self._previous_pages = previous["pages"]
+        self._pages = {}
+
+    def add(self, page_path, keys):
+        """Record keys of inputs page depends on, return if page is fresh.
+
+        Page is fresh if it exists and was built from same inputs.
+
+        """
+        keys = sorted(set(COMMON_KEYS).union(keys))
+        self._pages[page_path] = keys
+        return (
+            self._previous_pages.get(page_path) == keys and
+            all(
+                self._previous_inputs.get(key) == self._inputs[key]
+                for key in keys) and
+            os.path.isfile(page_path))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        temp_path = "{}.tmp".format(self._path)
+        with open(temp_path, "wb") as file:
+            file.write(
+                json.dumps(
+                    {"inputs": self._inputs, "pages": self._pages},
+                    sort_keys=True).encode("utf-8"))
+        os.replace(temp_path, self._path)
@@ -4,6 +4,7 @@ import enum
 @enum.unique
 class Feature(enum.Enum):
     about = 1
+    pagination = 2
 
 
 def make_feature_checker(requested_names, error_callback):
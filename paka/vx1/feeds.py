@@ -5,7 +5,6 @@ import pytz
 from paka.feedgenerator import Atom1Feed
 
 from . import translations
-from . import utils
 
 
 _DEFAULT_TIME = datetime.time(
@@ -46,13 +45,11 @@ def make_notes_feed(template_context):
         # Notes have only date, so add time with UTC timezone.
         updateddate = datetime.datetime.combine(note.date, _DEFAULT_TIME)
         # We use slugs, as they are more stable than tag names.
-        categories = [
-            tag.slug
-            for tag in utils.sort_tags(utils.get_tags(note, site=site))]
+        categories = [tag.slug for tag in site.index.note_to_tags[note.slug]]
         feed.add_item(
             title=_mktr("item_title", note=note),
             link=note_url,
-            description=note.body,
+            description=str(note.body),
             unique_id=note_url,
             unique_id_is_permalink=True,
             updateddate=updateddate,
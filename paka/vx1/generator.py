@@ -2,28 +2,35 @@ from __future__ import print_function
 
 import os
 import sys
+import shutil
 import locale
-import fnmatch
 import datetime
 import argparse
+import traceback
 import collections
 
-from paka.vx1.preparation import prepare_sites
-from paka.vx1.building import prepare_build_dir, build_site_by_spec
-from paka.vx1.static import build_static
-from paka.vx1.icons import build_icons
-from paka.vx1.nginx import build_nginx_config
-from paka.vx1.features import make_feature_checker
+# Modules that import heavy dependencies (Mako, lxml, Pygments, etc.) are
+# imported by functions of phases that need them, so that CLI starts fast.
+from paka.vx1.features import Feature, make_feature_checker
+from paka.vx1.writing import (
+    make_writer, remove_stale_files, get_compressed_suffixes)
 from paka.vx1.utils import subpaths
+from paka.vx1 import watching
+from paka.vx1 import profiling
+from paka.vx1 import storage
 
 
 INTERNAL_TEMPLATES_DIR = os.path.abspath(
     os.path.join(os.path.dirname(__file__), "templates"))
 
 
+# static_url_paths is mapping {file name: URL path} of static files (None
+# until they are built).
 SiteBuildSpec = collections.namedtuple(
     "SiteBuildSpec",
-    ["site", "site_build_dir", "pages_build_dir", "static_build_dir"])
+    [
+        "site", "site_build_dir", "pages_build_dir", "static_build_dir",
+        "static_url_paths"])
 
 
 def _set_build_dir(spec, build_dir):
@@ -42,21 +49,36 @@ def make_sites_specs(sites, build_dir):
     def mk(site):
         return SiteBuildSpec(
             site=site, site_build_dir=None, pages_build_dir=None,
-            static_build_dir=None)
+            static_build_dir=None, static_url_paths=None)
     return set_build_dir((mk(site) for site in sites), build_dir=build_dir)
 
 
+_Config = collections.namedtuple(
+    "_Config",
+    [
+        "blognets_dir", "networks_dir", "sites_dir",
+        "template_dirs_prepended", "template_dirs_appended", "build_dir",
+        "build_dir_future_path", "cache_dir", "slug_pattern", "current_date",
+        "feature_checker", "attr_overrides", "jobs", "profile_report_path",
+        "markdown_cache_size", "low_memory", "notes_per_page",
+        "write_threads", "precompress", "fingerprint_static", "minify_once"])
+
+
 def error_callback(text):
     print("[ERROR] {}".format(text), file=sys.stderr)
     sys.exit(1)
 
 
 def main(argv=sys.argv[1:]):
+    if argv[:1] == ["pack"]:
+        return _pack(argv[1:])
     locale.setlocale(locale.LC_ALL, "C")
     parser = argparse.ArgumentParser(prog="paka.vx1")
     parser.add_argument(
         "--blognets-dir",
-        help="dir containing input data (sites and networks)",
+        help=(
+            "dir containing input data (sites and networks), or file made "
+            "from it by pack command"),
         required=True)
     parser.add_argument(
         "--build-dir", help="dir that will contain output data",
@@ -84,9 +106,67 @@ def main(argv=sys.argv[1:]):
     parser.add_argument(
         "--features", nargs="*", default=[],
         help="names of build features to turn on")
+    parser.add_argument(
+        "--notes-per-page", type=int, default=20,
+        help="number of notes on page of list (with pagination feature)")
     parser.add_argument(
         "--site-attr-overrides", action="append",
         help="site_slug=path_to_attrs_file_with_pairs_to_update")
+    parser.add_argument(
+        "--jobs", type=int, default=1,
+        help="number of worker processes to read notes and build sites "
+        "with (0 means number of CPUs)")
+    parser.add_argument(
+        "--write-threads", type=int, default=4,
+        help=(
+            "number of threads (in each process) to copy and write files "
+            "with while pages are rendered; pages themselves are written "
+            "by rendering thread, and only replaced and precompressed by "
+            "these threads (0 means doing everything in rendering thread)"))
+    parser.add_argument(
+        "--precompress", action="store_true",
+        help=(
+            "write gzipped (and, if brotli is installed, brotli-compressed) "
+            "copies of HTML, Atom, CSS and JS files, make nginx serve them"))
+    parser.add_argument(
+        "--fingerprint-static", action="store_true",
+        help=(
+            "put hash of contents into names of CSS and JS files, make nginx "
+            "serve them with far-future immutable caching"))
+    parser.add_argument(
+        "--minify-once", action="store_true",
+        help=(
+            "minify each page in single pass, not its chunks, descriptions "
+            "and bodies of notes separately (faster, but whitespace at ends "
+            "of them may be kept, and HTML in feeds is not minified)"))
+    parser.add_argument(
+        "--markdown-cache-size", type=int, default=256,
+        help=(
+            "max size (in MiB) of cache of rendered Markdown in cache dir "
+            "(0 turns cache off)"))
+    parser.add_argument(
+        "--low-memory", action="store_true",
+        help=(
+            "do not keep rendered bodies of notes in memory, render them "
+            "(or read them from cache) when needed"))
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help=(
+            "keep previous build, render only pages whose inputs changed, "
+            "write only changed files and remove stale ones"))
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="build, then watch input files and rebuild affected sites")
+    parser.add_argument(
+        "--watch-interval", type=float, default=1.0,
+        help="seconds between checks for changes in watch mode")
+    parser.add_argument(
+        "--profile-report",
+        help=(
+            "path of JSON file to write wall and CPU times of build phases, "
+            "sites, views and steps to"))
+    parser.add_argument(
+        "--profile-dir", help="dir to write cProfile dump of each site to")
     args = parser.parse_args(argv)
 
     if args.current_date:
@@ -95,51 +175,311 @@ def main(argv=sys.argv[1:]):
     else:
         current_date = datetime.date.today()
 
-    blognets_dir = os.path.abspath(args.blognets_dir)
-    networks_dir = os.path.join(blognets_dir, "networks")
-    sites_dir = os.path.join(blognets_dir, "sites")
-
-    template_dirs_prepended = [
-        os.path.abspath(path)
-        for path in (args.template_dirs_prepend or ())]
-    template_dirs_appended = [
-        os.path.abspath(path)
-        for path in (args.template_dirs_append or ())]
+    if args.profile_report or args.profile_dir:
+        profiling.enable(
+            dump_dir=args.profile_dir and os.path.abspath(args.profile_dir))
+    profile_report_path = (
+        args.profile_report and os.path.abspath(args.profile_report))
 
+    blognets_dir = os.path.abspath(args.blognets_dir)
     build_dir = os.path.abspath(args.build_dir)
-    build_dir_future_path = os.path.abspath(
-        args.build_dir_future_path or build_dir)
-    cache_dir = os.path.abspath(args.cache_dir)
-
+    storage.use_packed(
+        blognets_dir if os.path.isfile(blognets_dir) else None,
+        extract_dir=os.path.join(os.path.abspath(args.cache_dir), "unpacked"))
     feature_checker = make_feature_checker(
         args.features, error_callback=error_callback)
+    notes_per_page = None
+    if feature_checker(Feature.pagination):
+        if args.notes_per_page < 1:
+            error_callback("Number of notes per page must be positive!")
+        notes_per_page = args.notes_per_page
+    config = _Config(
+        blognets_dir=blognets_dir,
+        networks_dir=os.path.join(blognets_dir, "networks"),
+        sites_dir=os.path.join(blognets_dir, "sites"),
+        template_dirs_prepended=[
+            os.path.abspath(path)
+            for path in (args.template_dirs_prepend or ())],
+        template_dirs_appended=[
+            os.path.abspath(path)
+            for path in (args.template_dirs_append or ())],
+        build_dir=build_dir,
+        build_dir_future_path=os.path.abspath(
+            args.build_dir_future_path or build_dir),
+        cache_dir=os.path.abspath(args.cache_dir),
+        slug_pattern=args.slug_pattern,
+        current_date=current_date,
+        feature_checker=feature_checker,
+        attr_overrides=args.site_attr_overrides or (),
+        jobs=args.jobs, profile_report_path=profile_report_path,
+        markdown_cache_size=args.markdown_cache_size * 1024 * 1024,
+        low_memory=args.low_memory, notes_per_page=notes_per_page,
+        write_threads=args.write_threads, precompress=args.precompress,
+        fingerprint_static=args.fingerprint_static,
+        minify_once=args.minify_once)
+
+    from paka.vx1.building import prepare_build_dir
+
+    if args.watch:
+        prepare_build_dir(config.build_dir, keep=True)
+        try:
+            _watch(config, interval=args.watch_interval)
+        except KeyboardInterrupt:
+            pass
+        return
+    sites = _prepare(config, error_callback=error_callback)
+    prepare_build_dir(config.build_dir, keep=args.incremental)
+    writer = make_writer(
+        incremental=args.incremental,
+        store_dir=os.path.join(config.cache_dir, "files"),
+        threads=config.write_threads, precompress=config.precompress)
+    specs, paths = _build(
+        sites, config=config, writer=writer, reuse_graphs=args.incremental,
+        error_callback=error_callback)
+    paths.append(_build_nginx_config(specs, config=config, writer=writer))
+    # Remove files left from previous build.
+    if args.incremental:
+        remove_stale_files(
+            config.build_dir, paths, keep_compressed=config.precompress)
+    writer.remove_unused_stored_files()
+    if config.profile_report_path:
+        profiling.write_report(config.profile_report_path)
 
-    sites = prepare_sites(
-        sites_dirs=subpaths(sites_dir),
-        networks_dir=networks_dir,
-        internal_templates_dir=INTERNAL_TEMPLATES_DIR,
-        prepended_templates_dirs=template_dirs_prepended,
-        appended_templates_dirs=template_dirs_appended,
-        current_date=current_date, error_callback=error_callback,
-        attr_overrides=args.site_attr_overrides or ())
-    # Determine which sites to build.
+
+def _pack(argv):
+    parser = argparse.ArgumentParser(
+        prog="paka.vx1 pack",
+        description=(
+            "Pack blognets dir into single file (to read input data "
+            "faster)."))
+    parser.add_argument(
+        "--blognets-dir",
+        help="dir containing input data (sites and networks)",
+        required=True)
+    parser.add_argument(
+        "--output", help="path of file to write", required=True)
+    args = parser.parse_args(argv)
+    storage.pack(args.blognets_dir, args.output)
+
+
+def _prepare(config, error_callback, prepared_sites=None, renderers=None):
+    """Return prepared sites that match slug pattern."""
+    from paka.vx1.preparation import prepare_sites
+    from paka.vx1 import caching
+
+    markdown_cache = None
+    if config.markdown_cache_size:
+        markdown_cache = caching.make_cache(
+            config.cache_dir, "markdown",
+            max_size=config.markdown_cache_size)
+    with profiling.measure(profiling.PHASES, "preparation"):
+        sites = prepare_sites(
+            sites_dirs=subpaths(config.sites_dir),
+            networks_dir=config.networks_dir,
+            internal_templates_dir=INTERNAL_TEMPLATES_DIR,
+            prepended_templates_dirs=config.template_dirs_prepended,
+            appended_templates_dirs=config.template_dirs_appended,
+            current_date=config.current_date, error_callback=error_callback,
+            attr_overrides=config.attr_overrides,
+            slug_pattern=config.slug_pattern, prepared_sites=prepared_sites,
+            renderers=renderers, jobs=config.jobs,
+            markdown_cache=markdown_cache, low_memory=config.low_memory,
+            module_directory=os.path.join(config.cache_dir, "templates"),
+            minify_fragments=not config.minify_once)
+        if markdown_cache is not None:
+            markdown_cache.evict()
+    return sites
+
+
+def _build(sites, config, writer, reuse_graphs, error_callback):
+    """Build sites, return their specs and paths of written files."""
+    from paka.vx1.building import build_sites_by_specs
+    from paka.vx1.static import build_static, get_url_paths
+    from paka.vx1.icons import build_icons
+
+    specs = make_sites_specs(sites, build_dir=config.build_dir)
+    # Build static (CSS, JS). This is done before pages, as they refer to
+    # (possibly fingerprinted) static files.
+    with profiling.measure(profiling.PHASES, "static"):
+        static_paths = build_static(
+            specs, writer=writer, error_callback=error_callback,
+            jobs=config.jobs, fingerprint=config.fingerprint_static)
+    paths = [
+        path for site_paths in static_paths for path in site_paths.values()]
+    specs = [
+        spec._replace(static_url_paths=get_url_paths(site_paths))
+        for spec, site_paths in zip(specs, static_paths)]
+    # Build pages.
+    with profiling.measure(profiling.PHASES, "pages"):
+        paths.extend(
+            build_sites_by_specs(
+                specs, feature_checker=config.feature_checker,
+                writer=writer,
+                graphs_dir=os.path.join(config.cache_dir, "pages"),
+                reuse_graphs=reuse_graphs, error_callback=error_callback,
+                jobs=config.jobs, notes_per_page=config.notes_per_page))
+        # Pages of each site are flushed by building, this is barrier for
+        # pages written by this process.
+        writer.flush()
+    # Build favicon, etc.
+    with profiling.measure(profiling.PHASES, "icons"):
+        paths.extend(
+            build_icons(
+                specs, writer=writer, error_callback=error_callback,
+                cache_dir=os.path.join(config.cache_dir, "icons"),
+                jobs=config.jobs))
+        writer.flush()
+    return specs, paths
+
+
+def _build_nginx_config(specs, config, writer):
+    from paka.vx1.nginx import build_nginx_config
+
+    specs = set_build_dir(specs, build_dir=config.build_dir_future_path)
+    with profiling.measure(profiling.PHASES, "nginx"):
+        path = build_nginx_config(
+            specs, build_dir=config.build_dir, writer=writer,
+            compressed_suffixes=(
+                get_compressed_suffixes() if config.precompress else ()),
+            fingerprinted_static=config.fingerprint_static)
+        writer.flush()
+    return path
+
+
+class _RebuildError(Exception):
+    pass
+
+
+def _watch_error_callback(text):
+    print("[ERROR] {}".format(text), file=sys.stderr)
+    raise _RebuildError(text)
+
+
+def _watch(config, interval):
+    """Build sites, then rebuild ones affected by changes of input files.
+
+    Prepared sites (with their template lookups) are kept in memory, so
+    only sites whose files changed are read again, and only sites of
+    affected networks are rebuilt (pages with unchanged inputs are not
+    rendered). Errors do not stop watching.
+
+    """
+    override_paths = {
+        path: slug
+        for slug, path in (s.split("=", 1) for s in config.attr_overrides)}
+    roots = (
+        [config.blognets_dir, INTERNAL_TEMPLATES_DIR] +
+        config.template_dirs_prepended + config.template_dirs_appended +
+        list(override_paths))
+    writer = make_writer(
+        incremental=True, store_dir=os.path.join(config.cache_dir, "files"),
+        threads=config.write_threads, precompress=config.precompress)
+    sites = []
+    changes = watching.iter_changes(roots, interval=interval)
+    pending_paths = None  # means everything has changed
+    while True:
+        try:
+            sites = _rebuild(
+                sites, changed_paths=pending_paths,
+                override_paths=override_paths, config=config,
+                writer=writer)
+        except _RebuildError:
+            pass  # retry with pending paths on next change
+        except Exception:  # e.g. malformed file that is being edited
+            traceback.print_exc()
+        else:
+            pending_paths = set()
+        print("Waiting for changes...", file=sys.stderr)
+        changed_paths = next(changes)
+        if pending_paths is not None:
+            pending_paths.update(changed_paths)
+
+
+def _rebuild(sites, changed_paths, override_paths, config, writer):
+    from paka.vx1 import translations
+    from paka.vx1 import dependencies
+    from paka.vx1 import rendering
+
+    storage.clear_cache()
+    translations.clear_cache()
+    dependencies.clear_cache()
+    rendering.clear_cache()
     slug_to_site = {site.slug: site for site in sites}
-    sites = [
-        slug_to_site[slug]
-        for slug in fnmatch.filter(slug_to_site, args.slug_pattern)]
-    # Build sites.
-    prepare_build_dir(build_dir)
-    specs = make_sites_specs(sites, build_dir=build_dir)
+    stale_slugs = set()  # sites to read again
+    stale_renderer_slugs = set()  # sites to make new template lookups for
+    changed_network_slugs = set()
+    network_to_sites_slugs = collections.defaultdict(set)
+    # Includes sites that are not built, but are listed by built ones.
+    site_to_network_slug = {}
+    for site in sites:
+        network_to_sites_slugs[site.network.slug].add(site.slug)
+        site_to_network_slug.update(
+            (slug, site.network.slug) for slug in site.network.sites_slugs)
+    for path in (changed_paths if changed_paths is not None else ()):
+        site_slug = watching.get_top_name(path, config.sites_dir)
+        network_slug = watching.get_top_name(path, config.networks_dir)
+        if site_slug:
+            stale_slugs.add(site_slug)
+            if site_slug in site_to_network_slug:
+                changed_network_slugs.add(site_to_network_slug[site_slug])
+            site_dir = os.path.join(config.sites_dir, site_slug)
+            if watching.get_top_name(path, site_dir) == "templates":
+                stale_renderer_slugs.add(site_slug)
+        elif network_slug:
+            changed_network_slugs.add(network_slug)
+            network_dir = os.path.join(config.networks_dir, network_slug)
+            if watching.get_top_name(path, network_dir) not in {
+                    "long_chunks", "short_chunks", "translations"}:
+                # Sites, logo or templates of network changed.
+                stale_slugs.update(network_to_sites_slugs[network_slug])
+                stale_renderer_slugs.update(
+                    network_to_sites_slugs[network_slug])
+        elif path in override_paths:
+            stale_slugs.add(override_paths[path])
+        else:  # non-network templates changed
+            stale_slugs.update(slug_to_site)
+            stale_renderer_slugs.update(slug_to_site)
+    prepared_sites = {
+        slug: site
+        for slug, site in slug_to_site.items() if slug not in stale_slugs}
+    renderers = {
+        slug: site.renderer
+        for slug, site in slug_to_site.items()
+        if slug not in stale_renderer_slugs}
+    if changed_paths is None:
+        prepared_sites = renderers = {}
+    new_sites = _prepare(
+        config, error_callback=_watch_error_callback,
+        prepared_sites=prepared_sites, renderers=renderers)
+    # Sites list names of other sites of their network, so whole network
+    # is affected by change in one site.
+    affected_network_slugs = changed_network_slugs.union(
+        site.network.slug
+        for site in new_sites if site.slug not in prepared_sites)
+    specs, paths = _build(
+        [
+            site for site in new_sites
+            if site.network.slug in affected_network_slugs],
+        config=config, writer=writer, reuse_graphs=True,
+        error_callback=_watch_error_callback)
     for spec in specs:
-        build_site_by_spec(
-            spec, feature_checker=feature_checker,
-            error_callback=error_callback)
-    # Build static (CSS, JS).
-    build_static(specs)
-    # Build favicon, etc.
-    build_icons(
-        specs, error_callback=error_callback,
-        cache_dir=os.path.join(cache_dir, "icons"))
-    # Build nginx config.
-    specs = set_build_dir(specs, build_dir=build_dir_future_path)
-    build_nginx_config(specs, build_dir=build_dir)
+        prefix = os.path.join(spec.site_build_dir, "")
+        remove_stale_files(
+            spec.site_build_dir,
+            [path for path in paths if path.startswith(prefix)],
+            keep_compressed=config.precompress)
+    # Remove sites that are not built anymore.
+    selected_slugs = {site.slug for site in new_sites}
+    for site_build_dir in subpaths(
+            os.path.join(config.build_dir, "sites"), ignore_not_exists=True):
+        if os.path.basename(site_build_dir) not in selected_slugs:
+            shutil.rmtree(site_build_dir)
+    _build_nginx_config(
+        make_sites_specs(new_sites, build_dir=config.build_dir),
+        config=config, writer=writer)
+    writer.remove_unused_stored_files()
+    if config.profile_report_path:
+        profiling.write_report(config.profile_report_path)
+    print(
+        "Rebuilt {} site(s).".format(len(specs)), file=sys.stderr)
+    return new_sites
@@ -1,27 +1,41 @@
 import io
 import re
+import functools
 
+import lxml.etree
 import lxml.html
+import pygments
 from pygments import (
     lexers as _lexers, formatters as _formatters,
     highlight as _pygments_highlight)
 from paka.cmark import lowlevel as _lowlevel
 
+from . import profiling
+
 
 _OPTS = _lowlevel.OPT_DEFAULT | _lowlevel.OPT_NOBREAKS | _lowlevel.OPT_UNSAFE
+# Output of render_commonmark is same for same text and version (increment
+# first part when changing code of this module).
+VERSION = ":".join([
+    "1", str(_OPTS), _lowlevel.text_from_c(_lowlevel.version_string()),
+    lxml.etree.__version__, pygments.__version__])
 
 
 def render_commonmark(text):
-    """Render CommonMark as HTML.
+    """Render CommonMark (str or UTF-8 bytes) as HTML.
 
     Highlights code in code blocks.
 
     """
-    text_bytes = _lowlevel.text_to_c(text)
+    if isinstance(text, bytes):
+        text_bytes = text
+    else:
+        text_bytes = _lowlevel.text_to_c(text)
     root = _lowlevel.parse_document(text_bytes, len(text_bytes), _OPTS)
     try:
         _substitute_code_blocks(root, _highlight)
-        result = _lowlevel.text_from_c(_lowlevel.render_html(root, _OPTS))
+        result = _lowlevel.text_from_c(
+            _lowlevel.render_html(root, _OPTS), free=True)
     finally:
         _lowlevel.node_free(root)
     return result
@@ -36,15 +50,26 @@ class _HtmlFormatter(_formatters.HtmlFormatter):
         yield (0, "</code></pre>")
 
 
+@functools.lru_cache(maxsize=None)
+def _get_lexer(fence_info):
+    """Return lexer for fence info.
+
+    Pygments imports module of lexer on first lookup, so only lexers that
+    are used get loaded (and only once).
+
+    """
+    if fence_info == "pycon3":
+        return _lexers.get_lexer_by_name("pycon", python3=True)
+    return _lexers.get_lexer_by_name(fence_info)
+
+
 def _highlight(fence_info, contents):
     """Highlight contents according to fence info."""
     if not fence_info:  # lexer name is not specified
         return
-    if fence_info == "pycon3":
-        lexer = _lexers.get_lexer_by_name("pycon", python3=True)
-    else:
-        lexer = _lexers.get_lexer_by_name(fence_info)
-    return _pygments_highlight(contents, lexer, _HtmlFormatter())
+    lexer = _get_lexer(fence_info)
+    with profiling.measure(profiling.STEPS, "pygments"):
+        return _pygments_highlight(contents, lexer, _HtmlFormatter())
 
 
 _match_highlighting_comment = re.compile(
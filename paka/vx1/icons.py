@@ -1,24 +1,49 @@
 import os
-import shutil
 import hashlib
 import subprocess
+import collections
 
+from . import parallel
 
-def build_icons(specs, error_callback, cache_dir):
+
+_Conversion = collections.namedtuple(
+    "_Conversion", ["spec", "in_path", "cached_path"])
+
+
+def build_icons(specs, writer, error_callback, cache_dir, jobs=1):
+    """Build icons of sites, return paths of written files."""
     os.makedirs(cache_dir, exist_ok=True)
+    cached_paths = []
+    # Several sites may share logo (e.g. network's one), so each distinct
+    # logo is converted only once.
+    conversions = collections.OrderedDict()
     for spec in specs:
         in_path = _get_existing_logo_file_path(
             spec.site, error_callback=error_callback)
         in_path_hash = _hash_file_contents(in_path, algorithm="sha1")
         cached_path = os.path.join(cache_dir, in_path_hash)
+        cached_paths.append(cached_path)
         if not os.path.exists(cached_path):
-            os.mkdir(cached_path)
-            for cmd in _make_cmds(in_path, cached_path):
-                _call(cmd, error_callback=error_callback)
-        for icon_file_name in os.listdir(cached_path):
-            shutil.copy(
-                os.path.join(cached_path, icon_file_name),
-                spec.pages_build_dir)
+            conversions.setdefault(
+                cached_path, _Conversion(spec, in_path, cached_path))
+    parallel.run(
+        _convert, conversions.values(), jobs=jobs,
+        error_callback=error_callback,
+        get_label=lambda conversion: conversion.spec.site.slug)
+    paths = []
+    for spec, cached_path in zip(specs, cached_paths):
+        for icon_file_name in sorted(os.listdir(cached_path)):
+            paths.append(
+                writer.copy(
+                    os.path.join(cached_path, icon_file_name),
+                    os.path.join(spec.pages_build_dir, icon_file_name)))
+    return paths
+
+
+def _convert(conversion, error_callback):
+    os.mkdir(conversion.cached_path)
+    for cmd in _make_cmds(conversion.in_path, conversion.cached_path):
+        _call(cmd, error_callback=error_callback)
 
 
 def _get_existing_logo_file_path(site, error_callback):
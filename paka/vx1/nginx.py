@@ -2,7 +2,7 @@ import os
 import collections
 
 from . import errorpages
-from . import utils
+from . import static
 
 
 _TEXT_CONTENT_TYPES = (
@@ -21,7 +21,7 @@ Directive = collections.namedtuple(
     "Directive", ["name", "arg", "children", "level"])
 
 
-def _get_servers(specs):
+def _get_servers(specs, compressed_suffixes, fingerprinted_static):
     def _end_slash(path):
         if not path.endswith("/"):
             return "".join((path, "/"))
@@ -36,7 +36,33 @@ def _get_servers(specs):
         children = list(_set_level(children, level))
         return Directive(name=name, arg=arg, children=children, level=level)
 
+    # Serving of precompressed files.
+    static_compression = tuple(
+        mk(name, "on")
+        for suffix, name in ((".gz", "gzip_static"), (".br", "brotli_static"))
+        if suffix in compressed_suffixes)
     for spec in sorted(specs, key=lambda spec: spec.site.slug):
+        static_dir = _end_slash(spec.static_build_dir)
+        static_locations = (
+            mk(
+                "location", static.URL_PATH, (
+                    mk("alias", static_dir),
+                    mk("expires", "1d"),
+                    mk("break"))), )
+        if fingerprinted_static:
+            # Fingerprinted static files never change, so they are cached
+            # forever.
+            static_locations += (
+                mk(
+                    "location",
+                    r'~ "^{}(.+\.[0-9a-f]{{{}}}\.(?:css|js))$"'.format(
+                        static.URL_PATH, static.FINGERPRINT_LENGTH), (
+                        mk("alias", "{}$1".format(static_dir)),
+                        mk(
+                            "add_header",
+                            'Cache-Control "public, max-age=31536000, '
+                            'immutable"'),
+                        mk("break"))), )
         domain = spec.site.attrs["domain"]
         yield (
             mk("listen", "80"),
@@ -54,6 +80,7 @@ def _get_servers(specs):
             mk("gzip_types", GZIPPED_CONTENT_TYPES),
             mk("gzip_vary", "on"),
             mk("gzip_comp_level", "6"),
+            ) + static_compression + (
             mk("charset", "utf-8"),
             mk("source_charset", "utf-8"),
             mk("charset_types", CHARSET_CONTENT_TYPES),
@@ -65,12 +92,7 @@ def _get_servers(specs):
                     mk("index", "index.html index.atom"),
                     mk("expires", "1d"),
                     mk("break"))),
-            mk(
-                "location", "/s/", (
-                    mk("alias", _end_slash(spec.static_build_dir)),
-                    mk("expires", "1d"),
-                    mk("break"))),
-            ) + tuple(
+            ) + static_locations + tuple(
                 mk(
                     "error_page",
                     "{} {}".format(code, errorpages.make_url_path(code)))
@@ -91,13 +113,24 @@ def _get_lines(directive):
         yield (tmpl_prefix + ";").format(d=directive, wsp=wsp)
 
 
-def build_nginx_config(specs, build_dir):
+def build_nginx_config(
+        specs, build_dir, writer, compressed_suffixes=(),
+        fingerprinted_static=False):
+    """Build config for nginx, return its path.
+
+    Serving of precompressed siblings of files is turned on for their
+    suffixes in compressed_suffixes (".br" needs ngx_brotli module). If
+    fingerprinted_static is true, fingerprinted static files are served
+    with far-future immutable caching.
+
+    """
     nginx_config_path = os.path.join(build_dir, "etc", "nginx.conf")
-    os.makedirs(os.path.dirname(nginx_config_path), exist_ok=True)
     lines = []
-    for server in _get_servers(specs):
+    for server in _get_servers(
+            specs, compressed_suffixes=compressed_suffixes,
+            fingerprinted_static=fingerprinted_static):
         lines.append("server {")
         for directive in server:
             lines.extend(_get_lines(directive))
         lines.append("}\n")
-    utils.write_file(nginx_config_path, "\n".join(lines))
+    return writer.write(nginx_config_path, "\n".join(lines))
@@ -0,0 +1,65 @@
+import os
+import multiprocessing
+
+from . import profiling
+
+
+# Task of current pool. Workers are forked, so they inherit it and only
+# indices of items (and results) have to cross process boundaries.
+_TASK = None
+
+
+class _TaskError(Exception):
+    pass
+
+
+def _raise_task_error(text):
+    raise _TaskError(text)
+
+
+def _run_item(index):
+    func, items = _TASK
+    try:
+        error_text, result = (
+            None, func(items[index], error_callback=_raise_task_error))
+    except _TaskError as e:
+        error_text, result = e.args[0], None
+    return error_text, result, profiling.pop_data()
+
+
+def get_jobs_count(jobs):
+    """Return number of worker processes to use (0 means all CPUs)."""
+    if jobs < 1:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def run(func, items, jobs, error_callback, get_label):
+    """Call func(item, error_callback=...) for each item, return results.
+
+    If jobs is more than one, items are processed by pool of forked worker
+    processes. In that case errors are reported (via error_callback) after
+    all items are processed, in order of items, and prefixed with label of
+    failed item.
+
+    """
+    global _TASK
+    items = list(items)
+    jobs = min(get_jobs_count(jobs), len(items))
+    if jobs <= 1:
+        return [func(item, error_callback=error_callback) for item in items]
+    _TASK = (func, items)
+    try:
+        context = multiprocessing.get_context("fork")
+        with context.Pool(
+                processes=jobs, initializer=profiling.forget) as pool:
+            outcomes = pool.map(_run_item, range(len(items)), chunksize=1)
+    finally:
+        _TASK = None
+    results = []
+    for item, (error_text, result, profiling_data) in zip(items, outcomes):
+        profiling.merge_data(profiling_data)
+        if error_text is not None:
+            error_callback("{}: {}".format(get_label(item), error_text))
+        results.append(result)
+    return results
@@ -1,10 +1,15 @@
 import os
 import re
+import fnmatch
 import datetime
+import itertools
+import functools
 import collections
 
 from . import rendering
 from . import consts
+from . import parallel
+from . import storage
 from . import utils
 
 
@@ -22,12 +27,20 @@ Site = collections.namedtuple(
     [
         "attrs", "slug", "notes", "series", "renderer",
         "network", "site_dir", "chunks_data", "tags", "logo_path",
-        "earliest_year", "current_year", "translations_data"])
+        "earliest_year", "current_year", "translations_data", "index"])
 Note = collections.namedtuple(
     "Note",
     [
         "attrs", "body", "slug", "date", "tags_slugs", "series_slugs",
         "substatic_root", "substatic_suffixes"])
+# Lookups that are needed to build pages of site (made once, as naive ones
+# are quadratic). Lists of notes are sorted with utils.sort_notes, lists of
+# tags (except popular_tags) are sorted with utils.sort_tags.
+SiteIndex = collections.namedtuple(
+    "SiteIndex",
+    [
+        "sorted_notes", "sorted_tags", "popular_tags", "tag_to_notes",
+        "series_to_notes", "note_to_tags"])
 Tag = collections.namedtuple(
     "Tag", ["attrs", "description", "slug", "notes_slugs"])
 Series = collections.namedtuple(
@@ -37,35 +50,106 @@ Series = collections.namedtuple(
 def prepare_sites(
         sites_dirs, networks_dir, internal_templates_dir,
         prepended_templates_dirs, appended_templates_dirs,
-        current_date, error_callback, attr_overrides):
+        current_date, error_callback, attr_overrides, slug_pattern="*",
+        prepared_sites=None, renderers=None, jobs=1, markdown_cache=None,
+        low_memory=False, module_directory=None, minify_fragments=True):
+    """Prepare sites that match slug_pattern (and their networks).
+
+    Other sites are not read, except attrs of sites that share network
+    with matching ones (network lists all its sites).
+
+    Sites from prepared_sites mapping {site slug: site} are not read again,
+    they are only linked to freshly read networks. Renderers from renderers
+    mapping {site slug: renderer} are used instead of making new ones.
+
+    If jobs is more than one, notes, tags and series of all sites are read
+    (and their Markdown and templates rendered) by one pool of processes.
+    Rendered Markdown is cached in markdown_cache (if passed). If low_memory
+    is true, bodies of notes are rendering.LazyMarkdown objects (so they are
+    not kept in memory). Compiled templates are stored in module_directory
+    (if passed). If minify_fragments is false, renderers made here minify
+    only whole pages (see rendering.make_renderer).
+
+    """
+    prepared_sites = prepared_sites or {}
+    renderers = renderers or {}
     attr_overrides = _parse_attr_overrides(attr_overrides)
-    networks = _get_networks(networks_dir, error_callback=error_callback)
+    sites_dirs = list(sites_dirs)
+    sites_slugs = {os.path.basename(site_dir) for site_dir in sites_dirs}
+    selected_slugs = set(fnmatch.filter(sites_slugs, slug_pattern))
+    networks = _get_networks(
+        networks_dir, sites_slugs=sites_slugs, error_callback=error_callback)
+    networks = [
+        network for network in networks
+        if selected_slugs.intersection(network.sites_slugs)]
     # Make {site_slug: network.network_dir} mapping to make template
     # search path (to make renderer).
     _site_slug_to_network_dir = {
         site_slug: network.network_dir
         for network in networks
         for site_slug in network.sites_slugs}
+    # Mapping {template search path: renderer}. Sites that have same search
+    # path (e.g. sites of network that have no templates of their own)
+    # share renderer, so its templates are compiled and kept once.
+    shared_renderers = {}
     sites = []
+    # Indices (in sites) of sites whose notes, tags and series are read.
+    read_indices = []
+    connected_sites = []
     for site_dir in sites_dirs:
         site = _make_site(site_dir)
-        internal_templates_dirs = [
-            os.path.join(_site_slug_to_network_dir[site.slug], "templates"),
-            os.path.join(site.site_dir, "templates"),
-            internal_templates_dir]
-        renderer = rendering.make_renderer(
-            charset=consts.CHARSET, prepended=prepended_templates_dirs,
-            internal=internal_templates_dirs,
-            appended=appended_templates_dirs)
+        if site.slug not in _site_slug_to_network_dir:
+            continue  # not needed for selected sites
+        if site.slug not in selected_slugs:
+            # Only attrs are shown by sites of network.
+            connected_sites.append(
+                _read_site_attrs(
+                    site, error_callback=error_callback,
+                    attr_override=attr_overrides.get(site.slug, {})))
+            continue
+        if site.slug in prepared_sites:
+            sites.append(prepared_sites[site.slug])
+            continue
+        renderer = renderers.get(site.slug)
+        if renderer is None:
+            # Dirs that do not exist do not affect search.
+            internal_templates_dirs = tuple(
+                path for path in (
+                    storage.get_real_path(
+                        os.path.join(
+                            _site_slug_to_network_dir[site.slug],
+                            "templates")),
+                    storage.get_real_path(
+                        os.path.join(site.site_dir, "templates")),
+                    internal_templates_dir)
+                if os.path.isdir(path))
+            renderer = shared_renderers.get(internal_templates_dirs)
+            if renderer is None:
+                renderer = shared_renderers[internal_templates_dirs] = (
+                    rendering.make_renderer(
+                        charset=consts.CHARSET,
+                        prepended=prepended_templates_dirs,
+                        internal=internal_templates_dirs,
+                        appended=appended_templates_dirs,
+                        markdown_cache=markdown_cache,
+                        module_directory=module_directory,
+                        minify_fragments=minify_fragments))
         # This needs explanation. We did _make_site(site_dir) to create object
         # with slug and site_dir fields, which we used to make template search
         # path. Now all other fields need to be filled (notes, tags, etc.)
+        read_indices.append(len(sites))
         sites.append(
-            _get_site(
-                site, current_date=current_date, renderer=renderer,
-                error_callback=error_callback,
+            _start_site(
+                site, renderer=renderer, error_callback=error_callback,
                 attr_override=attr_overrides.get(site.slug, {})))
-    return _set_up_networks(networks=networks, sites=sites)
+    read_sites = _get_sites(
+        [sites[index] for index in read_indices],
+        current_date=current_date, error_callback=error_callback, jobs=jobs,
+        low_memory=low_memory)
+    for index, site in zip(read_indices, read_sites):
+        sites[index] = site
+    return _set_up_networks(
+        networks=networks, sites=sites, connected_sites=connected_sites)
 
 
 def _parse_attr_overrides(raw_overrides):
@@ -76,68 +160,141 @@ def _parse_attr_overrides(raw_overrides):
     return attr_overrides
 
 
-def _get_networks(networks_dir, error_callback):
-    def _get_network(network_dir, error_callback):
+def _get_networks(networks_dir, sites_slugs, error_callback):
+    """Return networks with only sites_slugs field filled.
+
+    Also check that each site of sites_slugs belongs to exactly one network
+    and that networks do not list sites that do not exist.
+
+    """
+    networks = []
+    site_slug_to_network_slug = {}
+    for network_dir in utils.subpaths(networks_dir):
         network = Network(
             slug=os.path.basename(network_dir),
-            sites_slugs=[], sites=[],
-            network_dir=network_dir, chunks_data={}, translations_data={},
-            logo_path=_make_logo_path(network_dir))
-        network.sites_slugs.extend(
-            utils.read_slugs(network_dir, "sites-slugs"))
+            sites_slugs=utils.read_slugs(network_dir, "sites-slugs"),
+            sites=[], network_dir=network_dir, chunks_data={},
+            translations_data={}, logo_path=_make_logo_path(network_dir))
         if not network.sites_slugs:
             error_callback(
                 "{!r} network has less than one site!".format(network.slug))
-        network.chunks_data.update(utils.read_chunks(network_dir))
-        network.translations_data.update(utils.read_translations(network_dir))
-        return network
-    networks = []
-    for network_dir in utils.subpaths(networks_dir):
-        networks.append(
-            _get_network(network_dir, error_callback=error_callback))
+        for slug in network.sites_slugs:
+            if slug not in sites_slugs:
+                error_callback(
+                    "{!r} site of {!r} network does not exist!".format(
+                        slug, network.slug))
+            if slug in site_slug_to_network_slug:
+                error_callback(
+                    "{!r} site belongs to {!r} and {!r} networks!".format(
+                        slug, site_slug_to_network_slug[slug],
+                        network.slug))
+            site_slug_to_network_slug[slug] = network.slug
+        networks.append(network)
+    for slug in sorted(sites_slugs):
+        if slug not in site_slug_to_network_slug:
+            error_callback(
+                "{!r} site does not belong to any network!".format(slug))
     return networks
 
 
+def _fill_network(network):
+    network.chunks_data.update(utils.read_chunks(network.network_dir))
+    network.translations_data.update(
+        utils.read_translations(network.network_dir))
+    return network
+
+
 def _make_site(site_dir):
     return Site(
         attrs={}, slug=os.path.basename(site_dir), notes=[], series={},
         renderer=None, network=None, site_dir=site_dir, chunks_data={},
         tags={}, logo_path=None, earliest_year=None, current_year=None,
-        translations_data={})
+        translations_data={}, index=None)
 
 
-def _get_site(site, current_date, renderer, error_callback, attr_override):
-    site = site._replace(renderer=renderer)
-    # Read translations.
-    site.translations_data.update(
-        utils.read_translations(site.site_dir))
-    # Read attrs.
+def _read_site_attrs(site, error_callback, attr_override):
     site = site._replace(attrs=utils.read_attrs(site.site_dir))
     site.attrs.update(attr_override)
     utils.check_required_attrs(
         site.attrs, ("domain", "name", "date_format", "language"),
         entity_slug=site.slug,
         error_callback=error_callback)
-    # Read tags.
-    tags_dir = os.path.join(site.site_dir, "tags")
-    for tag_dir in utils.subpaths(tags_dir):
-        tag = _get_tag(
-            tag_dir, renderer=renderer, error_callback=error_callback)
+    return site
+
+
+def _start_site(site, renderer, error_callback, attr_override):
+    site = site._replace(renderer=renderer)
+    # Read translations.
+    site.translations_data.update(
+        utils.read_translations(site.site_dir))
+    # Read attrs.
+    return _read_site_attrs(
+        site, error_callback=error_callback, attr_override=attr_override)
+
+
+def _get_sites(sites, current_date, error_callback, jobs, low_memory):
+    """Read notes, tags and series of sites, return filled sites.
+
+    Items of all sites are read with one call of parallel.run (so with one
+    pool of processes).
+
+    """
+    items = []
+    counts = []
+    for site in sites:
+        renderer = site.renderer
+        site_items = [
+            functools.partial(_get_tag, path, renderer=renderer)
+            for path in utils.subpaths(os.path.join(site.site_dir, "tags"))]
+        tags_count = len(site_items)
+        site_items.extend(
+            functools.partial(_get_series, path, renderer=renderer)
+            for path in utils.subpaths(
+                os.path.join(site.site_dir, "series"),
+                ignore_not_exists=True))
+        series_count = len(site_items) - tags_count
+        site_items.extend(
+            functools.partial(
+                _get_note, path, renderer=renderer, low_memory=low_memory)
+            for path in utils.subpaths(os.path.join(site.site_dir, "notes")))
+        items.extend(site_items)
+        counts.append(
+            (tags_count, series_count,
+             len(site_items) - tags_count - series_count))
+    results = iter(
+        parallel.run(
+            _read_item, items, jobs=jobs, error_callback=error_callback,
+            get_label=lambda item: os.path.basename(item.args[0])))
+    return [
+        _finish_site(
+            site, tags=list(itertools.islice(results, tags_count)),
+            series=list(itertools.islice(results, series_count)),
+            notes=list(itertools.islice(results, notes_count)),
+            current_date=current_date, error_callback=error_callback)
+        for site, (tags_count, series_count, notes_count) in zip(
+            sites, counts)]
+
+
+def _read_item(get_item, error_callback):
+    return get_item(error_callback=error_callback)
+
+
+def _finish_site(site, tags, series, notes, current_date, error_callback):
+    for tag in tags:
         site.tags[tag.slug] = tag
-    # Read notes' series.
-    all_series_dir = os.path.join(site.site_dir, "series")
-    for series_dir in utils.subpaths(all_series_dir, ignore_not_exists=True):
-        series = _get_series(
-            series_dir, renderer=renderer, error_callback=error_callback)
-        site.series[series.slug] = series
-    # Read notes & populate site's notes list.
-    notes_dir = os.path.join(site.site_dir, "notes")
-    for note_dir in utils.subpaths(notes_dir):
-        site.notes.append(
-            _get_note(
-                note_dir, tags=site.tags.values(),
-                series=site.series.values(), renderer=renderer,
-                error_callback=error_callback))
+    for one_series in series:
+        site.series[one_series.slug] = one_series
+    # Populate site's notes list (notes are read before their tags and
+    # series are known).
+    note_to_tags_slugs = _invert(site.tags.values())
+    note_to_series_slugs = _invert(site.series.values())
+    # Sorted tuples take less memory than sets (and there are few items).
+    site.notes.extend(
+        note._replace(
+            tags_slugs=tuple(sorted(note_to_tags_slugs.get(note.slug, ()))),
+            series_slugs=tuple(
+                sorted(note_to_series_slugs.get(note.slug, ()))))
+        for note in notes)
     # Set earliest year (based on publication dates of notes)
     # and current year (value passed).
     site = site._replace(
@@ -184,10 +341,45 @@ def _get_site(site, current_date, renderer, error_callback, attr_override):
                     "{!r} series of {!r} site does not have "
                     "any notes associated!").format(
                         slug, site.slug))
-    return site
+    return site._replace(index=_make_site_index(site))
+
+
+def _invert(tags_or_series):
+    """Return mapping {note slug: slugs of tags (or series) of note}."""
+    note_to_slugs = collections.defaultdict(set)
+    for obj in tags_or_series:
+        for note_slug in obj.notes_slugs:
+            note_to_slugs[note_slug].add(obj.slug)
+    return note_to_slugs
+
+
+def _make_site_index(site):
+    sorted_notes = utils.sort_notes(site.notes)
+    tag_to_notes = {slug: [] for slug in site.tags}
+    series_to_notes = {slug: [] for slug in site.series}
+    for note in sorted_notes:
+        for slug in note.tags_slugs:
+            tag_to_notes[slug].append(note)
+        for slug in note.series_slugs:
+            series_to_notes[slug].append(note)
+
+    def popular_tags_sorting_key(tag):
+        return (-len(tag.notes_slugs), utils.tag_sorting_key(tag))
+
+    return SiteIndex(
+        sorted_notes=sorted_notes,
+        sorted_tags=utils.sort_tags(site.tags.values()),
+        popular_tags=sorted(
+            site.tags.values(), key=popular_tags_sorting_key),
+        tag_to_notes=tag_to_notes, series_to_notes=series_to_notes,
+        note_to_tags={
+            note.slug: utils.sort_tags(
+                site.tags[slug] for slug in note.tags_slugs)
+            for note in site.notes})
 
 
-def _get_note(note_dir, tags, series, renderer, error_callback):
+def _get_note(note_dir, renderer, error_callback, low_memory=False):
+    """Return note (without slugs of its tags and series)."""
     def _get_date_and_slug(note_dir):
         # '.../2015-08-08-some-slug' -> (date(), 'some-slug')
         dateslug = os.path.basename(note_dir)
@@ -201,14 +393,16 @@ def _get_note(note_dir, tags, series, renderer, error_callback):
         attrs, ("title", ),
         entity_slug=slug,
         error_callback=error_callback)
-    body = renderer.render_markdown(utils.read_subfile(note_dir, "body.md"))
-    tags_slugs = {tag.slug for tag in tags if slug in tag.notes_slugs}
-    series_slugs = {s.slug for s in series if slug in s.notes_slugs}
+    if low_memory:
+        body = renderer.make_lazy_markdown(os.path.join(note_dir, "body.md"))
+    else:
+        body = renderer.render_markdown(
+            utils.read_subfile_bytes(note_dir, "body.md"))
     substatic_root, substatic_suffixes = utils.get_substatic_data(note_dir)
     return Note(
-        slug=slug, date=date, body=body, attrs=attrs, tags_slugs=tags_slugs,
-        series_slugs=series_slugs, substatic_root=substatic_root,
-        substatic_suffixes=substatic_suffixes)
+        slug=slug, date=date, body=body, attrs=attrs, tags_slugs=(),
+        series_slugs=(), substatic_root=substatic_root,
+        substatic_suffixes=tuple(substatic_suffixes))
 
 
 def _get_tag(tag_dir, renderer, error_callback):
@@ -247,12 +441,12 @@ def _get_series(series_dir, renderer, error_callback):
         notes_slugs=notes_slugs)
 
 
-def _set_up_networks(networks, sites):
-    slug_to_site = {site.slug: site for site in sites}
+def _set_up_networks(networks, sites, connected_sites):
+    slug_to_site = {site.slug: site for site in sites + connected_sites}
     site_slug_to_network = {}
     for unfilled_network in networks:
         slugs = unfilled_network.sites_slugs
-        network = unfilled_network._replace(
+        network = _fill_network(unfilled_network)._replace(
             sites=[slug_to_site[slug] for slug in slugs])
         for slug in slugs:
             site_slug_to_network[slug] = network
@@ -262,4 +456,4 @@ def _set_up_networks(networks, sites):
 
 
 def _make_logo_path(base_dir):
-    return os.path.join(base_dir, "logo.xcf")
+    return storage.get_real_path(os.path.join(base_dir, "logo.xcf"))
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import cProfile
+import contextlib
+
+
+# Groups of measurements.
+PHASES = "phases"
+SITES = "sites"
+VIEWS = "views"
+STEPS = "steps"
+# Group of counters (only number of events is recorded).
+COUNTERS = "counters"
+
+# None if profiling is off, otherwise {(group, name): [wall, cpu,
+# self_wall, self_cpu, count]}. "self" times exclude nested measurements.
+_DATA = None
+# Stack of active measurements.
+_STACK = []
+# Dir for cProfile dumps (or None).
+_DUMP_DIR = None
+
+
+def enable(dump_dir=None):
+    global _DATA, _DUMP_DIR
+    _DATA = {}
+    _DUMP_DIR = dump_dir
+
+
+def forget():
+    """Forget collected data (e.g. data inherited by forked worker)."""
+    if _DATA is not None:
+        _DATA.clear()
+    del _STACK[:]
+
+
+def pop_data():
+    """Return collected data (to merge in other process), forget it."""
+    if _DATA is None:
+        return None
+    data = list(_DATA.items())
+    _DATA.clear()
+    return data
+
+
+def merge_data(data):
+    for key, values in (data or ()):
+        _add(key, values)
+
+
+def _add(key, values):
+    try:
+        totals = _DATA[key]
+    except KeyError:
+        _DATA[key] = list(values)
+    else:
+        for i, value in enumerate(values):
+            totals[i] += value
+
+
+class _Measurement(object):
+
+    def __init__(self, key):
+        self._key = key
+
+    def __enter__(self):
+        # Same key may be nested (e.g. template rendered inside template),
+        # total of it is counted only once (for outermost measurement).
+        self._is_outermost = all(m._key != self._key for m in _STACK)
+        self._child_wall = self._child_cpu = 0
+        _STACK.append(self)
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        _STACK.pop()
+        if _STACK:
+            _STACK[-1]._child_wall += wall
+            _STACK[-1]._child_cpu += cpu
+        total_wall, total_cpu = (wall, cpu) if self._is_outermost else (0, 0)
+        _add(
+            self._key,
+            (
+                total_wall, total_cpu, wall - self._child_wall,
+                cpu - self._child_cpu, 1))
+
+
+class _NoMeasurement(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+_NO_MEASUREMENT = _NoMeasurement()
+
+
+def measure(group, name):
+    """Return context manager that measures wall and CPU time of block."""
+    if _DATA is None:
+        return _NO_MEASUREMENT
+    return _Measurement((group, name))
+
+
+def record(group, name, wall, cpu, count=1):
+    """Record measurements made without measure (e.g. in other thread)."""
+    if _DATA is not None:
+        _add((group, name), (wall, cpu, wall, cpu, count))
+
+
+def count(name):
+    """Count event (e.g. cache hit)."""
+    if _DATA is not None:
+        _add((COUNTERS, name), (0, 0, 0, 0, 1))
+
+
+@contextlib.contextmanager
+def dump_profile(name):
+    """Run block under cProfile, dump stats to <dump dir>/<name>.prof."""
+    if _DATA is None or _DUMP_DIR is None:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        os.makedirs(_DUMP_DIR, exist_ok=True)
+        profile.dump_stats(os.path.join(_DUMP_DIR, "{}.prof".format(name)))
+
+
+def write_report(path):
+    report = {group: {} for group in (PHASES, SITES, VIEWS, STEPS, COUNTERS)}
+    for (group, name), values in sorted(_DATA.items()):
+        if group == COUNTERS:
+            report[group][name] = values[-1]
+        else:
+            report[group][name] = dict(
+                zip(
+                    ("wall", "cpu", "self_wall", "self_cpu", "count"),
+                    values))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(
+            json.dumps(report, indent=2, sort_keys=True).encode("utf-8"))
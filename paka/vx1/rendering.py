@@ -1,43 +1,344 @@
+import os
+import re
+import hashlib
+import functools
 import collections
 
 import mako.lookup
+import mako.runtime
 import mako.template
+import paka.webstatic.htmlmin
 from paka.webstatic.htmlmin import htmlmin
 
 from .highlighting import render_commonmark
+from . import highlighting
+from . import caching
+from . import profiling
+from . import storage
 
 
 _TemplatePath = collections.namedtuple(
     "_TemplatePath", ["prepended", "internal", "appended"])
+# Part of keys of compiled templates (increment when changing options of
+# compiled templates).
+_TEMPLATE_VERSION = "3"
 
 
-def make_renderer(charset, prepended, internal, appended):
+def _hash_module_source(module):
+    with open(module.__file__, "rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+# Part of keys of rendered Markdown, which is rendered by highlighting and
+# minified by htmlmin (paka.webstatic has no version attribute, so source
+# of its htmlmin module is hashed).
+_MARKDOWN_VERSION = ":".join(
+    [highlighting.VERSION, _hash_module_source(paka.webstatic.htmlmin)])
+# Same for Markdown that is not minified (see make_renderer).
+_UNMINIFIED_MARKDOWN_VERSION = ":".join([_MARKDOWN_VERSION, "unminified"])
+
+
+def make_renderer(
+        charset, prepended, internal, appended, markdown_cache=None,
+        module_directory=None, minify_fragments=True):
+    """Make renderer of templates and Markdown.
+
+    If markdown_cache (see caching) is passed, rendered Markdown is looked
+    up in and stored to it. If module_directory is passed, templates are
+    compiled to modules in it (so they are compiled once, not once per
+    process or build).
+
+    If minify_fragments is false, rendered template text and Markdown are
+    not minified, so pages that include them are minified in single pass
+    (output differs: whitespace at ends of fragments may be kept, and HTML
+    escaped into feeds is not minified).
+
+    """
     templatepath = _TemplatePath(
         prepended=list(prepended), internal=list(internal),
         appended=list(appended))
-    return _Renderer(charset, templatepath)
+    return _Renderer(
+        charset, templatepath, markdown_cache=markdown_cache,
+        module_directory=module_directory, minify_fragments=minify_fragments)
 
 
 class _Renderer(object):
 
-    def __init__(self, charset, templatepath):
+    def __init__(self, charset, templatepath, markdown_cache,
+                 module_directory, minify_fragments):
         directories = []
         for part in templatepath:
             directories.extend(part)
+        self.directories = directories
+        lookup_options = {}
+        if module_directory is not None:
+            lookup_options["modulename_callable"] = functools.partial(
+                _make_module_filename,
+                os.path.join(module_directory, "lookup"))
         self._template_lookup = mako.lookup.TemplateLookup(
             directories=directories, input_encoding=charset,
             output_encoding=charset, default_filters=["decode.utf8"],
-            filesystem_checks=False, strict_undefined=True)
+            filesystem_checks=False, strict_undefined=True,
+            **lookup_options)
         self._charset = charset
+        self._markdown_cache = markdown_cache
+        self._module_directory = module_directory
+        self.minify_fragments = minify_fragments
+        # Mapping {(text, strict): compiled template} for render_text.
+        self._text_templates = {}
 
     def __call__(self, template_name, **kwargs):
-        template = self._template_lookup.get_template(template_name)
-        return htmlmin(template.render(**kwargs).decode(self._charset))
+        with profiling.measure(profiling.STEPS, "mako_render"):
+            template = self._template_lookup.get_template(template_name)
+            rendered = template.render_unicode(**kwargs)
+        return _htmlmin(rendered)
+
+    def render_to(self, file, template_name, **kwargs):
+        """Render template, write minified result to text file.
+
+        Unlike __call__, result is written in parts as it is rendered, so
+        whole of it is never kept in memory.
+
+        """
+        minifier = _HtmlminWriter(file)
+        with profiling.measure(profiling.STEPS, "mako_render"):
+            template = self._template_lookup.get_template(template_name)
+            template.render_context(
+                mako.runtime.Context(minifier, **kwargs), **kwargs)
+        minifier.close()
 
     def render_text(self, text, **kwargs):
-        return htmlmin(
-            mako.template.Template(
-                text, lookup=self._template_lookup).render(**kwargs))
+        """Render template text."""
+        return self._render_text(text, False, kwargs)
+
+    def render_text_strict(self, text, **kwargs):
+        """Render template text, raising NameError for missing names."""
+        return self._render_text(text, True, kwargs)
+
+    def _render_text(self, text, strict, kwargs):
+        with profiling.measure(profiling.STEPS, "mako_render"):
+            rendered = self._get_text_template(text, strict).render(**kwargs)
+        if not self.minify_fragments:
+            return rendered
+        return _htmlmin(rendered)
+
+    def _get_text_template(self, text, strict):
+        try:
+            return self._text_templates[text, strict]
+        except KeyError:
+            pass
+        with profiling.measure(profiling.STEPS, "mako_compile"):
+            if self._module_directory is None:
+                template = mako.template.Template(
+                    text, lookup=self._template_lookup,
+                    strict_undefined=strict)
+            else:
+                template = self._load_text_template(text, strict)
+        self._text_templates[text, strict] = template
+        return template
+
+    def _load_text_template(self, text, strict):
+        # Mako stores compiled modules only for templates in files, so text
+        # is written to file named after it.
+        key = caching.make_key(
+            _TEMPLATE_VERSION, "strict" if strict else "", text)
+        text_dir = os.path.join(self._module_directory, "text")
+        path = os.path.join(text_dir, "{}.mako".format(key))
+        if not os.path.exists(path):
+            os.makedirs(text_dir, exist_ok=True)
+            temp_path = "{}.{}.tmp".format(path, os.getpid())
+            with open(temp_path, "wb") as file:
+                file.write(text.encode(self._charset))
+            os.replace(temp_path, path)
+        return mako.template.Template(
+            filename=path, uri=key, input_encoding=self._charset,
+            module_filename=os.path.join(text_dir, "{}.py".format(key)),
+            lookup=self._template_lookup, strict_undefined=strict)
 
     def render_markdown(self, text):
-        return htmlmin(render_commonmark(text))
+        """Render Markdown (str or UTF-8 bytes) as HTML."""
+        return _render_markdown(
+            text, cache=self._markdown_cache, minify=self.minify_fragments)
+
+    def make_lazy_markdown(self, path):
+        """Return Markdown of file that is rendered when needed."""
+        return LazyMarkdown(
+            path, cache=self._markdown_cache, minify=self.minify_fragments)
+
+
+def _make_module_filename(lookup_module_directory, filename, uri):
+    # Same URI may be found in different dirs (for different sites), and
+    # file may change between builds, so module is named after path and
+    # contents of template file.
+    with open(filename, "rb") as file:
+        digest = hashlib.sha1(file.read()).hexdigest()
+    key = caching.make_key(_TEMPLATE_VERSION, filename, digest)
+    return os.path.join(lookup_module_directory, "{}.py".format(key))
+
+
+def _make_markdown_key(text, minify):
+    return caching.make_key(
+        _MARKDOWN_VERSION if minify else _UNMINIFIED_MARKDOWN_VERSION, text)
+
+
+def _render_markdown(text, cache, minify):
+    if cache is None:
+        return _render_markdown_uncached(text, minify)
+    key = _make_markdown_key(text, minify)
+    rendered = cache.get(key)
+    if rendered is None:
+        rendered = _render_markdown_uncached(text, minify)
+        cache.set(key, rendered)
+    return rendered
+
+
+def _render_markdown_uncached(text, minify):
+    with profiling.measure(profiling.STEPS, "render_commonmark"):
+        rendered = render_commonmark(text)
+    if not minify:
+        return rendered
+    return _htmlmin(rendered)
+
+
+# Mapping {(path, minify): rendered Markdown} of recently used lazy Markdown
+# files (least recently used first).
+_RECENT_MARKDOWN = collections.OrderedDict()
+_RECENT_MARKDOWN_MAX_COUNT = 32
+
+
+def clear_cache():
+    """Forget recently rendered Markdown files (needed if files changed)."""
+    _RECENT_MARKDOWN.clear()
+
+
+class LazyMarkdown(object):
+    """Markdown file that is rendered when converted to str.
+
+    Rendered HTML is not kept by object, so memory used by it does not
+    depend on size of file.
+
+    """
+
+    __slots__ = ("path", "_cache", "_minify")
+
+    def __init__(self, path, cache, minify=True):
+        self.path = path
+        self._cache = cache
+        self._minify = minify
+
+    def __str__(self):
+        key = (self.path, self._minify)
+        try:
+            _RECENT_MARKDOWN.move_to_end(key)
+        except KeyError:
+            _RECENT_MARKDOWN[key] = _render_markdown(
+                storage.read_bytes(self.path), cache=self._cache,
+                minify=self._minify)
+            if len(_RECENT_MARKDOWN) > _RECENT_MARKDOWN_MAX_COUNT:
+                _RECENT_MARKDOWN.popitem(last=False)
+        return _RECENT_MARKDOWN[key]
+
+    def __html__(self):
+        return str(self)
+
+    def get_key(self):
+        """Return key that changes whenever rendered HTML may change."""
+        return _make_markdown_key(
+            storage.read_bytes(self.path), minify=self._minify)
+
+
+def _htmlmin(text):
+    with profiling.measure(profiling.STEPS, "htmlmin"):
+        return htmlmin(text)
+
+
+# Same as in htmlmin.
+_HTMLMIN_RE = re.compile(r">[ \t\n\r\f\v]+<")
+_PRE_RE = re.compile(r"(<pre[^>]*?>.*?</pre>)", re.IGNORECASE | re.DOTALL)
+_PRE_START = "<pre"
+_PRE_START_RE = re.compile(_PRE_START, re.IGNORECASE)
+
+
+class _HtmlminWriter(object):
+    """Text file-like object that writes minified HTML to other file.
+
+    Result is same as of htmlmin for all written text, but only text that
+    can not be minified yet (e.g. unfinished <pre> element) is kept.
+
+    """
+
+    def __init__(self, file, block_size=65536):
+        self._file = file
+        self._block_size = block_size
+        self._parts = []
+        self._size = 0
+        self._pending = ""
+        # Whether pending text starts fragment (text around <pre>
+        # elements), whose leading whitespace is stripped.
+        self._at_start = True
+        # Whether nothing was minified yet (htmlmin strips whole text).
+        self._at_document_start = True
+
+    def write(self, text):
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self._block_size:
+            self._minify(final=False)
+
+    def close(self):
+        self._minify(final=True)
+
+    def _minify(self, final):
+        with profiling.measure(profiling.STEPS, "htmlmin"):
+            self._parts.insert(0, self._pending)
+            text = "".join(self._parts)
+            self._parts = []
+            self._size = 0
+            # Found <pre> elements do not change when text is added.
+            pos = 0
+            for match in _PRE_RE.finditer(text):
+                self._write_fragment(text[pos:match.start()], end=True)
+                pre = match.group()
+                if pre.startswith(_PRE_START):
+                    self._file.write(pre)
+                else:  # htmlmin minifies e.g. <PRE> elements
+                    self._write_fragment(pre, end=True)
+                pos = match.end()
+                self._at_document_start = False
+            if final:
+                self._pending = ""
+                self._write_last_fragment(text[pos:])
+                return
+            # Text is cut after character that is not whitespace and not
+            # ">" (so whitespace is not stripped and ">" followed by
+            # whitespace is not split), before possible (maybe not fully
+            # written yet) start of <pre>.
+            pre_start = _PRE_START_RE.search(text, pos)
+            cut = max(pos, len(text) - len(_PRE_START) + 1)
+            if pre_start is not None:
+                cut = min(pre_start.start(), cut)
+            while cut > pos and (text[cut - 1].isspace() or
+                                 text[cut - 1] == ">"):
+                cut -= 1
+            if cut > pos:
+                self._write_fragment(text[pos:cut], end=False)
+                self._at_document_start = False
+            self._pending = text[cut:]
+
+    def _write_last_fragment(self, text):
+        if self._at_document_start:
+            text = text.lstrip()
+        if self._at_start and text.startswith(_PRE_START):
+            # htmlmin does not minify unfinished <pre> element.
+            self._file.write(text.rstrip())
+        else:
+            self._write_fragment(text, end=True)
+
+    def _write_fragment(self, text, end):
+        text = _HTMLMIN_RE.sub("><", text)
+        if self._at_start:
+            text = text.lstrip()
+        if end:
+            text = text.rstrip()
+        self._file.write(text)
+        self._at_start = end or (self._at_start and not text)
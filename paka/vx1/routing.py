@@ -88,6 +88,16 @@ class Map(object):
 
 
 def add_routes(routes_map, feature_checker):
+    if feature_checker(features.Feature.pagination):
+        # First pages of paginated lists are at URLs of lists themselves.
+        routes_map.add_route(
+            "/tags/{tag.slug}/page/{page_number}/", view_name="one_tag_page",
+            template_name="one_tag.html", fmt=Fmt.html,
+            parent_view_name="one_tag")
+        routes_map.add_route(
+            "/notes/page/{page_number}/", view_name="all_notes_page",
+            template_name="all_notes.html", fmt=Fmt.html,
+            parent_view_name="all_notes")
     routes_map.add_route(
         "/tags/{tag.slug}/feed/", view_name="recent_tag_notes_feed",
         template_name="notes_feed.mako", fmt=Fmt.atom,
@@ -1,12 +1,35 @@
 import os
+import hashlib
+import functools
 
 import paka.webstatic.pipeline as _pipeline
 
+from . import consts
+from . import parallel
 
-def _make_output(spec, filename):
-    return _pipeline.Output(
-        os.path.join(spec.static_build_dir, filename),
-        makedirs=True)
+
+# URL path of dir with static files.
+URL_PATH = "/s/"
+# Mapping {file name: URL path} of static files that are not fingerprinted.
+DEFAULT_URL_PATHS = {
+    name: "".join((URL_PATH, name)) for name in ("styles.css", "scripts.js")}
+# Number of hex digits of hash in names of fingerprinted files.
+FINGERPRINT_LENGTH = 16
+
+
+def _make_output(spec, filename, writer, fingerprint):
+    def _output(input_):
+        name = filename
+        if fingerprint:
+            # E.g. styles.0123456789abcdef.css.
+            stem, ext = os.path.splitext(filename)
+            digest = hashlib.sha1(
+                input_.data.encode(consts.CHARSET)).hexdigest()
+            name = "{}.{}{}".format(stem, digest[:FINGERPRINT_LENGTH], ext)
+        input_.path = writer.write(
+            os.path.join(spec.static_build_dir, name), input_.data)
+        return input_
+    return _output
 
 
 def _make_input(spec, template_name):
@@ -14,21 +37,49 @@ def _make_input(spec, template_name):
         None, data=spec.site.renderer(template_name))
 
 
-def _gen_css_pipeline(spec):
+def _gen_css_pipeline(spec, writer, fingerprint):
     yield from (
         _make_input(spec, "styles.css.mako"),
         _pipeline.CSSMin(),
-        _make_output(spec, "styles.css"))
+        _make_output(
+            spec, "styles.css", writer=writer, fingerprint=fingerprint))
 
 
-def _gen_js_pipeline(spec):
+def _gen_js_pipeline(spec, writer, fingerprint):
     yield from (
         _make_input(spec, "scripts.js.mako"),
         _pipeline.JSMin(),
-        _make_output(spec, "scripts.js"))
+        _make_output(
+            spec, "scripts.js", writer=writer, fingerprint=fingerprint))
+
+
+def _build_site_static(spec, writer, fingerprint, error_callback):
+    paths = {
+        name: _pipeline.run(
+            func(spec, writer=writer, fingerprint=fingerprint)).path
+        for name, func in (
+            ("styles.css", _gen_css_pipeline),
+            ("scripts.js", _gen_js_pipeline))}
+    writer.flush()
+    return paths
+
+
+def build_static(specs, writer, error_callback, jobs=1, fingerprint=False):
+    """Build CSS and JS of sites, return mapping {file name: path} per spec.
+
+    If fingerprint is true, hash of contents is part of names of written
+    files (see get_url_paths).
+
+    """
+    return parallel.run(
+        functools.partial(
+            _build_site_static, writer=writer, fingerprint=fingerprint),
+        specs, jobs=jobs, error_callback=error_callback,
+        get_label=lambda spec: spec.site.slug)
 
 
-def build_static(specs):
-    for spec in specs:
-        for func in (_gen_css_pipeline, _gen_js_pipeline):
-            _pipeline.run(func(spec))
+def get_url_paths(paths):
+    """Return mapping {file name: URL path} for result of build_static."""
+    return {
+        name: "".join((URL_PATH, os.path.basename(path)))
+        for name, path in paths.items()}
@@ -0,0 +1,194 @@
+import os
+import shutil
+import sqlite3
+
+
+# Packed storage of input files (see use_packed) or None. Paths that are
+# not under path of packed file are always read from file system.
+_PACKED = None
+
+
+def pack(blognets_dir, path):
+    """Write all files and dirs of blognets_dir to packed file at path."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = "{}.tmp".format(path)
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = sqlite3.connect(temp_path)
+    try:
+        with connection:
+            connection.execute(
+                "CREATE TABLE entries (path TEXT PRIMARY KEY, data BLOB)")
+            for dirpath, dirnames, filenames in os.walk(blognets_dir):
+                dirnames.sort()
+                rel_dir = _to_key(os.path.relpath(dirpath, blognets_dir))
+                # Data of dirs is NULL.
+                connection.execute(
+                    "INSERT INTO entries VALUES (?, NULL)", (rel_dir, ))
+                for filename in sorted(filenames):
+                    with open(os.path.join(dirpath, filename), "rb") as file:
+                        data = file.read()
+                    connection.execute(
+                        "INSERT INTO entries VALUES (?, ?)",
+                        (_join_key(rel_dir, filename), data))
+    finally:
+        connection.close()
+    os.replace(temp_path, path)
+
+
+def _to_key(rel_path):
+    if rel_path == os.curdir:
+        return ""
+    return "/".join(rel_path.split(os.sep))
+
+
+def _join_key(key, name):
+    return "{}/{}".format(key, name) if key else name
+
+
+def use_packed(path, extract_dir=None):
+    """Read input files under path from packed file at path.
+
+    Files that are needed as files (e.g. templates) are extracted to
+    extract_dir. If path is None, all files are read from file system.
+
+    """
+    global _PACKED
+    _PACKED = path and _PackedStorage(
+        os.path.abspath(path), extract_dir=extract_dir)
+
+
+def clear_cache():
+    """Forget index of packed file (needed if packed file changed)."""
+    if _PACKED is not None:
+        _PACKED.clear_cache()
+
+
+def _get_packed(path):
+    if _PACKED is not None and _PACKED.contains(path):
+        return _PACKED
+    return None
+
+
+def listdir(path):
+    packed = _get_packed(path)
+    if packed is None:
+        return os.listdir(path)
+    return packed.listdir(path)
+
+
+def read_bytes(path):
+    packed = _get_packed(path)
+    if packed is None:
+        with open(path, "rb") as file:
+            return file.read()
+    return packed.read_bytes(path)
+
+
+def get_real_path(path):
+    """Return path of file (or dir) in file system.
+
+    Path of non-existent file (or dir) is returned if path does not exist.
+
+    """
+    packed = _get_packed(path)
+    if packed is None:
+        return path
+    return packed.extract(path)
+
+
+class _PackedStorage(object):
+
+    def __init__(self, path, extract_dir):
+        self._path = path
+        self._extract_dir = extract_dir
+        self.clear_cache()
+
+    def clear_cache(self):
+        self._connection = None
+        self._dirs = None
+        self._extracted = set()
+
+    def contains(self, path):
+        return path == self._path or path.startswith(
+            os.path.join(self._path, ""))
+
+    def _to_key(self, path):
+        return _to_key(os.path.relpath(path, self._path))
+
+    def _get_connection(self):
+        # Connection must not be shared with forked processes.
+        if self._connection is None or self._connection[0] != os.getpid():
+            self._connection = (os.getpid(), sqlite3.connect(self._path))
+        return self._connection[1]
+
+    def _get_dirs(self):
+        """Return mapping {dir key: {name: is dir}}."""
+        if self._dirs is None:
+            dirs = {}
+            for key, is_dir in self._get_connection().execute(
+                    "SELECT path, data IS NULL FROM entries"):
+                if is_dir:
+                    dirs.setdefault(key, {})
+                if key:
+                    parent, _, name = key.rpartition("/")
+                    dirs.setdefault(parent, {})[name] = bool(is_dir)
+            self._dirs = dirs
+        return self._dirs
+
+    def listdir(self, path):
+        try:
+            return list(self._get_dirs()[self._to_key(path)])
+        except KeyError:
+            raise FileNotFoundError(path)
+
+    def read_bytes(self, path):
+        row = self._get_connection().execute(
+            "SELECT data FROM entries WHERE path = ? AND data IS NOT NULL",
+            (self._to_key(path), )).fetchone()
+        if row is None:
+            raise FileNotFoundError(path)
+        return row[0]
+
+    def extract(self, path):
+        """Extract file or dir (if not done yet), return its real path."""
+        key = self._to_key(path)
+        real_path = os.path.join(self._extract_dir, *key.split("/"))
+        if key not in self._extracted:
+            self._extract(key, real_path)
+            self._extracted.add(key)
+        return real_path
+
+    def _extract(self, key, real_path):
+        parent, _, name = key.rpartition("/")
+        is_dir = self._get_dirs().get(parent, {}).get(name)
+        if is_dir is None:  # does not exist in packed file
+            if os.path.isdir(real_path):
+                shutil.rmtree(real_path)
+            elif os.path.lexists(real_path):
+                os.remove(real_path)
+        elif is_dir:
+            if os.path.lexists(real_path) and not os.path.isdir(real_path):
+                os.remove(real_path)
+            os.makedirs(real_path, exist_ok=True)
+            names = self._get_dirs()[key]
+            for existing_name in os.listdir(real_path):
+                if existing_name not in names:
+                    self._extract(
+                        _join_key(key, existing_name),
+                        os.path.join(real_path, existing_name))
+            for name in names:
+                self._extract(
+                    _join_key(key, name), os.path.join(real_path, name))
+        else:
+            data = self.read_bytes(os.path.join(self._path, *key.split("/")))
+            if os.path.isdir(real_path):
+                shutil.rmtree(real_path)
+            try:
+                with open(real_path, "rb") as file:
+                    if file.read() == data:
+                        return
+            except (IOError, OSError):
+                os.makedirs(os.path.dirname(real_path), exist_ok=True)
+            with open(real_path, "wb") as file:
+                file.write(data)
@@ -90,6 +90,16 @@
   </ol>
 </%def>
 
+<%def name="render_pagination(page)">
+  % if page and len(page.url_paths) > 1:
+    <ol class="p-l">
+      % for number, page_url_path in enumerate(page.url_paths, 1):
+        <%self:link target="${page_url_path}" item="${True}">${number}</%self:link>
+      % endfor
+    </ol>
+  % endif
+</%def>
+
 <%def name="render_heading(breadcrumbs)">
   <% crumb = breadcrumbs[-1] %>
   <h1>${crumb.heading}</h1>
@@ -136,10 +146,16 @@
   ${render_feed(routes_map.format_url_path('recent_notes_feed', context={}), capture(render_translation, 'recent_notes_feed_title', {'site': site}))}
 </%def>
 <%def name="render_styles()" filter="trim">
-  <link rel="stylesheet" href="/s/styles.css">
+  <%
+      from paka.vx1.consts import STATIC_URL_PATHS_TEMPLATE_CONTEXT_KEY
+  %>
+  <link rel="stylesheet" href="${context[STATIC_URL_PATHS_TEMPLATE_CONTEXT_KEY]['styles.css'] | h}">
 </%def>
 <%def name="render_scripts()" filter="trim">
-  <script src="/s/scripts.js" type="text/javascript"></script>
+  <%
+      from paka.vx1.consts import STATIC_URL_PATHS_TEMPLATE_CONTEXT_KEY
+  %>
+  <script src="${context[STATIC_URL_PATHS_TEMPLATE_CONTEXT_KEY]['scripts.js'] | h}" type="text/javascript"></script>
 </%def>
 
 <%def name="render_footer_years(site, separator)" filter="trim">
@@ -4,6 +4,11 @@ import markupsafe
 _DATA_CACHE = {}
 
 
+def clear_cache():
+    """Forget merged translations (needed if translations data changed)."""
+    _DATA_CACHE.clear()
+
+
 def translate(key, context, site, escape=True):
     cache_key = "_".join((site.network.slug, site.slug))
     data = _DATA_CACHE.get(cache_key)
@@ -2,6 +2,8 @@ import os
 
 import markupsafe
 
+from . import storage
+
 
 CHARSET = "utf-8"
 
@@ -13,9 +15,7 @@ def write_file(path, contents):
 
 def read_file(path):
     """Read file and return its contents as str."""
-    with open(path, "rb") as file:
-        binary_contents = file.read()
-    return binary_contents.decode(CHARSET)
+    return storage.read_bytes(path).decode(CHARSET)
 
 
 def read_subfile(base_dir, subfile_name):
@@ -23,10 +23,15 @@ def read_subfile(base_dir, subfile_name):
     return read_file(os.path.join(base_dir, subfile_name))
 
 
+def read_subfile_bytes(base_dir, subfile_name):
+    """Read file located in dir and return its contents as bytes."""
+    return storage.read_bytes(os.path.join(base_dir, subfile_name))
+
+
 def subpaths(base_dir, ignore_not_exists=False):
-    """Generate paths for all things in dir. Like os.path.join + listdir."""
+    """Generate sorted paths for all things in dir (os.path.join + listdir)."""
     try:
-        names = os.listdir(base_dir)
+        names = sorted(storage.listdir(base_dir))
     except (IOError, OSError) as e:
         if ignore_not_exists:
             return
@@ -37,7 +42,8 @@ def subpaths(base_dir, ignore_not_exists=False):
 
 def subpaths_rec(base_dir):
     for dirpath, dirnames, filenames in os.walk(base_dir, followlinks=False):
-        for filename in filenames:
+        dirnames.sort()
+        for filename in sorted(filenames):
             yield os.path.join(dirpath, filename)
 
 
@@ -76,7 +82,7 @@ def read_translations(base_dir):
 def read_kv_dir(base_dir):
     """Construct mapping {file name: file contents} from dir with files."""
     data = {}
-    for file_name in os.listdir(base_dir):
+    for file_name in storage.listdir(base_dir):
         data[file_name] = read_subfile(base_dir, file_name)
     return data
 
@@ -110,12 +116,6 @@ def check_required_attrs(attrs, attr_names, entity_slug, error_callback):
                     name, entity_slug))
 
 
-def get_tags(note, site):
-    for tag_slug, tag in site.tags.items():
-        if tag_slug in note.tags_slugs:
-            yield tag
-
-
 def tag_sorting_key(tag):
     return tag.attrs["name"].casefold()
 
@@ -129,7 +129,7 @@ def sort_notes(notes):
 
 
 def get_substatic_data(obj_dir):
-    root = os.path.join(obj_dir, "substatic")
+    root = storage.get_real_path(os.path.join(obj_dir, "substatic"))
     if os.path.isdir(root):
         suffixes = [
             os.path.relpath(subpath, start=root)
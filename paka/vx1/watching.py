@@ -0,0 +1,60 @@
+import os
+import time
+
+
+def _iter_files(root):
+    if os.path.isfile(root):
+        yield root
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            yield os.path.join(dirpath, filename)
+
+
+def take_snapshot(roots):
+    """Return mapping {file path: (mtime, size)} for files in roots.
+
+    Roots are paths of dirs or files.
+
+    """
+    snapshot = {}
+    for root in roots:
+        for path in _iter_files(root):
+            try:
+                stat = os.stat(path)
+            except (IOError, OSError):  # removed while walking
+                continue
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def get_changed_paths(old_snapshot, new_snapshot):
+    """Return paths of added, removed and modified files."""
+    return {
+        path
+        for path in set(old_snapshot).union(new_snapshot)
+        if old_snapshot.get(path) != new_snapshot.get(path)}
+
+
+def iter_changes(roots, interval):
+    """Poll roots every interval seconds, yield sets of changed paths.
+
+    Changes are counted from the moment of call (not of first iteration).
+
+    """
+    def _iter(snapshot):
+        while True:
+            time.sleep(interval)
+            new_snapshot = take_snapshot(roots)
+            changed_paths = get_changed_paths(snapshot, new_snapshot)
+            snapshot = new_snapshot
+            if changed_paths:
+                yield changed_paths
+    return _iter(take_snapshot(roots))
+
+
+def get_top_name(path, base_dir):
+    """Return name of item of base_dir that contains path (or None)."""
+    rel_path = os.path.relpath(path, base_dir)
+    if rel_path == os.curdir or rel_path.startswith(os.pardir):
+        return None
+    return rel_path.split(os.sep, 1)[0]
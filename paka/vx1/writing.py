@@ -0,0 +1,420 @@
+import os
+import gzip
+import shutil
+import time
+import hashlib
+import filecmp
+import threading
+import functools
+import contextlib
+import collections
+
+from . import consts
+from . import profiling
+
+
+# Suffixes of written files that are precompressed (HTML, Atom, CSS, JS).
+_COMPRESSIBLE_SUFFIXES = (".html", ".atom", ".css", ".js")
+# Suffixes of all possible precompressed siblings of files.
+_COMPRESSED_SUFFIXES = (".gz", ".br")
+# Size of blocks files are read in.
+_BLOCK_SIZE = 65536
+# CPU time of current thread (there is no time.thread_time before Python
+# 3.7, so CPU time of background writes is not measured there).
+_thread_time = getattr(time, "thread_time", lambda: 0)
+
+
+def make_writer(incremental, store_dir=None, threads=0, precompress=False):
+    """Make writer of build output files.
+
+    If store_dir is passed, copied files are stored in it once per
+    distinct contents and hard-linked to their destinations (or copied,
+    if store_dir and destinations are on different file systems). If
+    threads is more than zero, files are written by that many background
+    threads (see _Writer). If precompress is true, compressed
+    siblings (see get_compressed_suffixes) of written compressible files
+    are written too.
+
+    """
+    store = None if store_dir is None else _Store(store_dir)
+    return _Writer(
+        incremental=incremental, store=store, threads=threads,
+        precompress=precompress)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_compressors():
+    compressors = [(".gz", _compress_gzip)]
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        compressors.append(
+            (".br", functools.partial(_compress_brotli, brotli)))
+    return tuple(compressors)
+
+
+def get_compressed_suffixes():
+    """Return suffixes of precompressed siblings (.br needs brotli)."""
+    return tuple(suffix for suffix, _ in _get_compressors())
+
+
+def _compress_gzip(src_file, dest_file):
+    # Same data is always compressed to same bytes.
+    with gzip.GzipFile(
+            filename="", mode="wb", compresslevel=9, fileobj=dest_file,
+            mtime=0) as file:
+        shutil.copyfileobj(src_file, file, _BLOCK_SIZE)
+
+
+def _compress_brotli(brotli, src_file, dest_file):
+    compressor = brotli.Compressor(quality=11)
+    for block in _iter_blocks(src_file):
+        dest_file.write(compressor.process(block))
+    dest_file.write(compressor.finish())
+
+
+def _iter_blocks(file):
+    return iter(functools.partial(file.read, _BLOCK_SIZE), b"")
+
+
+class _Writer(object):
+    """Write build output files.
+
+    In incremental mode files that already have needed contents are left
+    untouched (to keep their mtimes).
+
+    With background threads write and copy return before file is written,
+    so flush must be called before output files are used (or process is
+    forked). Number of files waiting to be written is limited. Files
+    returned by open are written by calling thread, only replacing of
+    destination and precompression are done in background.
+
+    """
+
+    def __init__(self, incremental, store, threads, precompress):
+        self._incremental = incremental
+        self._store = store
+        self._threads = threads
+        self.precompress = precompress
+        # (pid, executor) or None. Executor must not be shared with forked
+        # processes.
+        self._executor = None
+        self._pending = collections.deque()
+        # Wall and CPU times of done background tasks.
+        self._task_times = collections.deque()
+        self._slots = threading.BoundedSemaphore(max(threads, 1) * 8)
+
+    def write(self, path, contents):
+        """Write str contents to file, return path."""
+        self._submit(self._write, path, contents)
+        return path
+
+    def _write(self, path, contents):
+        data = contents.encode(consts.CHARSET)
+        changed = not (self._incremental and _has_contents(path, data))
+        if changed:
+            # File may be link to stored file that must not change.
+            _remove(path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as file:
+                file.write(data)
+        if self.precompress and path.endswith(_COMPRESSIBLE_SUFFIXES):
+            self._write_compressed(path, changed=changed)
+
+    @contextlib.contextmanager
+    def open(self, path):
+        """Return context manager of text file that is written to path.
+
+        Contents are written to temporary file as they come (so they are
+        not kept in memory), which replaces file at path on exit.
+
+        """
+        with profiling.measure(profiling.STEPS, "write"):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = _make_temp_path(path)
+            file = open(temp_path, "w", encoding=consts.CHARSET, newline="")
+        try:
+            yield _MeasuredFile(file)
+        except BaseException:
+            file.close()
+            _remove(temp_path)
+            raise
+        with profiling.measure(profiling.STEPS, "write"):
+            file.close()
+            self._submit(self._replace, temp_path, path)
+
+    def _replace(self, temp_path, path):
+        changed = not (
+            self._incremental and _is_same_data(temp_path, path))
+        if changed:
+            # File at path may be link to stored file, but replacing
+            # does not change stored file.
+            os.replace(temp_path, path)
+        else:
+            os.remove(temp_path)
+        if self.precompress and path.endswith(_COMPRESSIBLE_SUFFIXES):
+            self._write_compressed(path, changed=changed)
+
+    def _write_compressed(self, path, changed):
+        # File is compressed as it is read (it is not read in memory).
+        digest = None
+        stat = os.stat(path)
+        for suffix, compress in _get_compressors():
+            compressed_path = "".join((path, suffix))
+            if not changed and _is_compressed_from(compressed_path, stat):
+                continue
+            _remove(compressed_path)
+            write_data = functools.partial(_compress_file, compress, path)
+            # Data that was compressed before is not compressed again.
+            if self._store is not None:
+                digest = digest or _hash_file(path)
+            if digest is None or not self._store.link_data(
+                    "".join((digest, suffix)), write_data, compressed_path):
+                with open(compressed_path, "wb") as file:
+                    write_data(file)
+            # Sibling gets times of file (see _is_compressed_from), even if
+            # it is stored (times of stored files do not matter).
+            os.utime(compressed_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    def copy(self, src_path, dest_path):
+        """Copy file, return destination path."""
+        self._submit(self._copy, src_path, dest_path)
+        return dest_path
+
+    def _copy(self, src_path, dest_path):
+        # Size and mtime are compared first, then (if needed) contents.
+        if self._incremental and _is_same_file(src_path, dest_path):
+            return
+        # File may be link to stored file that must not change.
+        _remove(dest_path)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        if self._store is not None and self._store.link(src_path, dest_path):
+            return
+        if self._incremental:
+            shutil.copy2(src_path, dest_path)
+        else:
+            shutil.copyfile(src_path, dest_path)
+
+    def _submit(self, func, *args):
+        if self._threads < 1:
+            func(*args)
+            return
+        # Error of finished write is raised as soon as possible.
+        while self._pending and self._pending[0].done():
+            self._pending.popleft().result()
+        if self._executor is None or self._executor[0] != os.getpid():
+            import concurrent.futures
+
+            self._executor = (
+                os.getpid(),
+                concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self._threads))
+        self._slots.acquire()
+        try:
+            future = self._executor[1].submit(self._run_timed, func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._pending.append(future)
+
+    def _run_timed(self, func, *args):
+        wall = time.perf_counter()
+        cpu = _thread_time()
+        try:
+            func(*args)
+        finally:
+            self._task_times.append(
+                (time.perf_counter() - wall, _thread_time() - cpu))
+
+    def flush(self):
+        """Wait until all files are written, stop background threads.
+
+        Error of first failed write (if any) is raised. Times of background
+        writes are recorded (see profiling) as "write_background" step.
+
+        """
+        executor, self._executor = self._executor, None
+        if executor is None or executor[0] != os.getpid():
+            return
+        executor[1].shutdown(wait=True)
+        times, self._task_times = self._task_times, collections.deque()
+        if times:
+            profiling.record(
+                profiling.STEPS, "write_background",
+                wall=sum(wall for wall, _ in times),
+                cpu=sum(cpu for _, cpu in times), count=len(times))
+        pending, self._pending = self._pending, collections.deque()
+        for future in pending:
+            future.result()
+
+    def remove_unused_stored_files(self):
+        """Remove stored files that are not linked to any destination."""
+        if self._store is not None:
+            self._store.remove_unused()
+
+
+class _MeasuredFile(object):
+    """Text file whose writes are measured (see profiling)."""
+
+    def __init__(self, file):
+        self._file = file
+
+    def write(self, text):
+        with profiling.measure(profiling.STEPS, "write"):
+            return self._file.write(text)
+
+
+class _Store(object):
+    """Store of files named after hashes of their contents."""
+
+    def __init__(self, store_dir):
+        self._store_dir = store_dir
+        self._can_link = True
+
+    def link(self, src_path, dest_path):
+        """Hard-link stored copy of file to dest_path, return if linked."""
+        if not self._can_link:
+            return False
+        return self._link(self._add(src_path), dest_path)
+
+    def link_data(self, key, write_data, dest_path):
+        """Hard-link data stored under key to dest_path, return if linked.
+
+        write_data is called with binary file to write data to only if
+        there is no data under key yet.
+
+        """
+        if not self._can_link:
+            return False
+        path = self._make_path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = _make_temp_path(path)
+            with open(temp_path, "wb") as file:
+                write_data(file)
+            os.replace(temp_path, path)
+        return self._link(path, dest_path)
+
+    def _make_path(self, key):
+        return os.path.join(self._store_dir, key[:2], key)
+
+    def _link(self, stored_path, dest_path):
+        try:
+            os.link(stored_path, dest_path)
+        except OSError:
+            # E.g. different file systems or no support for hard links.
+            self._can_link = False
+            return False
+        return True
+
+    def _add(self, src_path):
+        path = self._make_path(_hash_file(src_path))
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = _make_temp_path(path)
+            shutil.copy2(src_path, temp_path)
+            os.replace(temp_path, path)
+        return path
+
+    def remove_unused(self):
+        try:
+            subdirs = os.listdir(self._store_dir)
+        except (IOError, OSError):  # nothing was stored yet
+            return
+        for subdir in subdirs:
+            for entry in os.scandir(os.path.join(self._store_dir, subdir)):
+                if entry.stat().st_nlink < 2:
+                    os.remove(entry.path)
+
+
+def _compress_file(compress, path, dest_file):
+    with open(path, "rb") as file:
+        compress(file, dest_file)
+
+
+def _hash_file(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in _iter_blocks(file):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _make_temp_path(path):
+    # Same file may be stored by several processes and threads at once.
+    return "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _has_contents(path, data):
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+        with open(path, "rb") as file:
+            return file.read() == data
+    except (IOError, OSError):
+        return False
+
+
+def _is_same_data(path, other_path):
+    try:
+        if os.path.getsize(path) != os.path.getsize(other_path):
+            return False
+        with open(path, "rb") as file, open(other_path, "rb") as other_file:
+            while True:
+                block = file.read(_BLOCK_SIZE)
+                if block != other_file.read(_BLOCK_SIZE):
+                    return False
+                if not block:
+                    return True
+    except (IOError, OSError):
+        return False
+
+
+def _is_compressed_from(compressed_path, stat):
+    """Return if compressed sibling is not older than file (of stat).
+
+    Sibling is older if file was written (e.g. without precompression)
+    after sibling was made.
+
+    """
+    try:
+        return os.stat(compressed_path).st_mtime_ns >= stat.st_mtime_ns
+    except (IOError, OSError):
+        return False
+
+
+def _is_same_file(src_path, dest_path):
+    try:
+        return filecmp.cmp(src_path, dest_path, shallow=True)
+    except (IOError, OSError):
+        return False
+
+
+def remove_stale_files(build_dir, paths, keep_compressed=False):
+    """Remove files (and empty dirs) in build dir that are not in paths.
+
+    If keep_compressed is true, precompressed siblings of files in paths
+    are kept.
+
+    """
+    paths = set(paths)
+    for dirpath, dirnames, filenames in os.walk(build_dir, topdown=False):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            base_path, suffix = os.path.splitext(path)
+            if path not in paths and not (
+                    keep_compressed and suffix in _COMPRESSED_SUFFIXES and
+                    base_path in paths):
+                os.remove(path)
+        if dirpath != build_dir and not os.listdir(dirpath):
+            os.rmdir(dirpath)
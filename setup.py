@@ -14,7 +14,7 @@ setuptools.setup(
     version="3.5.0",
     packages=setuptools.find_packages(),
     install_requires=_get_install_requirements(),
-    extras_require={"testing": []},
+    extras_require={"testing": [], "brotli": ["brotli"]},
     include_package_data=True,
     namespace_packages=["paka"],
     zip_safe=False,
@@ -0,0 +1,45 @@
+import types
+
+import testutils
+
+
+class ChunksTest(testutils.TestCase):
+
+    def make_site(self, network_chunks_data, chunks_data):
+        from paka.vx1.rendering import make_renderer
+
+        renderer = make_renderer(
+            charset="utf-8", prepended=[], internal=[], appended=[])
+        return types.SimpleNamespace(
+            slug="site", renderer=renderer, chunks_data=chunks_data,
+            network=types.SimpleNamespace(chunks_data=network_chunks_data))
+
+    def test_site_chunks_rendered_once(self):
+        from paka.vx1.building import _make_chunks, _make_site_chunks
+
+        site = self.make_site(
+            {"about": "<p>${site.slug}</p>", "footer": "<p>net</p>"},
+            {
+                "footer": "<p>${view_name}</p>", "broken": "${1 // 0}",
+                "nested": "${context['chunks']['about']()}"})
+        errors = []
+        site_chunks = _make_site_chunks(
+            site, site_context={"site": site},
+            required_chunk_names=["about", "footer", "missing"],
+            error_callback=errors.append)
+        self.assertEqual(
+            errors, ["'missing' chunk does not exist for site site!"])
+        for chunk_name in ("footer", "broken", "nested"):
+            self.assertIsNone(site_chunks[chunk_name][1])
+        chunks = [
+            _make_chunks(
+                site, site_chunks=site_chunks,
+                context={"site": site, "view_name": view_name})
+            for view_name in ("home", "about")]
+        self.assertIs(chunks[0]["about"], chunks[1]["about"])
+        self.assertEqual(
+            [(c["about"](), c["footer"]()) for c in chunks],
+            [("<p>site</p>", "<p>home</p>"), ("<p>site</p>", "<p>about</p>")])
+        # Broken chunk is reported when page renders it.
+        with self.assertRaises(ZeroDivisionError):
+            chunks[0]["broken"]()
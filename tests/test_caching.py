@@ -0,0 +1,41 @@
+import os
+
+import testutils
+
+
+class CacheTest(testutils.TestCase):
+
+    def setUp(self):
+        from paka.vx1 import caching
+
+        super().setUp()
+        self.caching = caching
+
+    def test_get_set(self):
+        cache = self.caching.make_cache(
+            self.make_temp_dir(), "test", max_size=100)
+        key = self.caching.make_key("a", "b")
+        self.assertNotEqual(key, self.caching.make_key("ab"))
+        self.assertIsNone(cache.get(key))
+        cache.set(key, "Привет")
+        self.assertEqual(cache.get(key), "Привет")
+
+    def test_key_of_bytes(self):
+        # Keys do not change if parts are passed as bytes.
+        self.assertEqual(
+            self.caching.make_key("а", "Привет".encode("utf-8")),
+            self.caching.make_key("а", "Привет"))
+
+    def test_evict_least_recently_used(self):
+        cache_dir = self.make_temp_dir()
+        cache = self.caching.make_cache(cache_dir, "test", max_size=20)
+        keys = [self.caching.make_key(str(n)) for n in range(3)]
+        for n, key in enumerate(keys):
+            cache.set(key, "0123456789")
+            path = os.path.join(cache_dir, "test", key[:2], key)
+            os.utime(path, ns=(n, n))
+        cache.get(keys[0])  # touch
+        cache.evict()
+        self.assertEqual(
+            [cache.get(key) is not None for key in keys],
+            [True, False, True])
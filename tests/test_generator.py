@@ -1,16 +1,397 @@
 import os
+import json
+import shutil
 
 import testutils
 
 
 class GeneratorTest(testutils.TestCase):
 
+    def check_build(self, extra_argv=()):
+        self.check_build_to(self.make_temp_dir(), extra_argv=extra_argv)
+
+    def check_build_to(self, temp_dir, extra_argv=()):
+        test_files_dir = os.path.join(testutils.TEST_FILES_DIR, "generator1")
+        self.generate(
+            src=os.path.join(test_files_dir, "source"), dest=temp_dir,
+            extra_argv=extra_argv)
+        self.assert_dirs_equal(
+            os.path.join(temp_dir, "build"),
+            os.path.join(test_files_dir, "build"),
+            ignore_contents=["*.png", "*.ico", "*.atom", "nginx.conf"])
+
     def test_build(self):
+        self.check_build()
+
+    def test_build_with_jobs(self):
+        self.check_build(extra_argv=["--jobs", "2"])
+
+    def test_build_with_low_memory(self):
+        self.check_build(extra_argv=["--low-memory", "--jobs", "2"])
+
+    def test_build_with_minify_once(self):
+        # Pages are same, only feeds (not compared) differ.
+        self.check_build(
+            extra_argv=["--minify-once", "--markdown-cache-size", "0"])
+
+    def test_build_from_packed_file(self):
+        from paka.vx1.generator import main
+
         test_files_dir = os.path.join(testutils.TEST_FILES_DIR, "generator1")
         temp_dir = self.make_temp_dir()
-        self.generate(
-            src=os.path.join(test_files_dir, "source"), dest=temp_dir)
+        src = os.path.join(temp_dir, "source")
+        shutil.copytree(
+            os.path.join(test_files_dir, "source"), src,
+            ignore=shutil.ignore_patterns("nets"))
+        main(argv=[
+            "pack", "--blognets-dir",
+            os.path.join(test_files_dir, "source", "nets"),
+            "--output", os.path.join(src, "nets")])
+        self.generate(src=src, dest=temp_dir)
         self.assert_dirs_equal(
             os.path.join(temp_dir, "build"),
             os.path.join(test_files_dir, "build"),
             ignore_contents=["*.png", "*.ico", "*.atom", "nginx.conf"])
+
+    def test_incremental_build(self):
+        test_files_dir = os.path.join(testutils.TEST_FILES_DIR, "generator1")
+        temp_dir = self.make_temp_dir()
+        build_dir = os.path.join(temp_dir, "build")
+        page_path = os.path.join(
+            build_dir, "sites", "93z_dev", "pages", "index.html")
+        stale_path = os.path.join(
+            build_dir, "sites", "93z_dev", "pages", "stale", "index.html")
+        self.generate(
+            src=os.path.join(test_files_dir, "source"), dest=temp_dir)
+        os.makedirs(os.path.dirname(stale_path))
+        with open(stale_path, "wb"):
+            pass
+        os.utime(page_path, ns=(0, 0))
+        self.generate(
+            src=os.path.join(test_files_dir, "source"), dest=temp_dir,
+            extra_argv=["--incremental"])
+        self.assertEqual(os.stat(page_path).st_mtime_ns, 0)
+        self.assertFalse(os.path.exists(os.path.dirname(stale_path)))
+        self.assert_dirs_equal(
+            build_dir, os.path.join(test_files_dir, "build"),
+            ignore_contents=["*.png", "*.ico", "*.atom", "nginx.conf"])
+
+    def test_incremental_build_renders_only_affected_pages(self):
+        from unittest import mock
+
+        from paka.vx1 import rendering
+
+        test_files_dir = os.path.join(testutils.TEST_FILES_DIR, "generator1")
+        temp_dir = self.make_temp_dir()
+        src = os.path.join(temp_dir, "source")
+        shutil.copytree(os.path.join(test_files_dir, "source"), src)
+        self.generate(src=src, dest=temp_dir)
+        body_path = os.path.join(
+            src, "nets", "sites", "93z_py", "notes",
+            "2010-08-29-sort-dict-keys-by-values", "body.md")
+        with open(body_path, "ab") as file:
+            file.write(b"\nOne more paragraph.\n")
+        rendered = []
+        render_to = rendering._Renderer.render_to
+
+        def _render_to(renderer, file, template_name, **kwargs):
+            rendered.append((kwargs["site"].slug, kwargs["url_path"]))
+            return render_to(renderer, file, template_name, **kwargs)
+
+        with mock.patch.object(rendering._Renderer, "render_to", _render_to):
+            self.generate(
+                src=src, dest=temp_dir, extra_argv=["--incremental"])
+        self.assertEqual(
+            sorted(rendered),
+            [
+                ("93z_py", "/notes/feed/"),
+                ("93z_py", "/notes/sort-dict-keys-by-values/"),
+                ("93z_py", "/tags/cpython/feed/")])
+
+    def test_build_by_slug_pattern(self):
+        test_files_dir = os.path.join(testutils.TEST_FILES_DIR, "generator1")
+        temp_dir = self.make_temp_dir()
+        src = os.path.join(temp_dir, "source")
+        shutil.copytree(os.path.join(test_files_dir, "source"), src)
+        # Notes of other sites are not read, so broken one does not matter.
+        os.remove(
+            os.path.join(
+                src, "nets", "sites", "93z_dev", "notes",
+                "2016-03-18-missing-growl.js-tutorial", "attrs"))
+        self.generate(
+            src=src, dest=temp_dir, extra_argv=["--slug-pattern", "93z_py"])
+        sites_build_dir = os.path.join(temp_dir, "build", "sites")
+        self.assertEqual(os.listdir(sites_build_dir), ["93z_py"])
+        self.assert_dirs_equal(
+            os.path.join(sites_build_dir, "93z_py"),
+            os.path.join(test_files_dir, "build", "sites", "93z_py"),
+            ignore_contents=["*.png", "*.ico", "*.atom"])
+
+    def test_profile_report(self):
+        temp_dir = self.make_temp_dir()
+        report_path = os.path.join(temp_dir, "report.json")
+        self.check_build(extra_argv=["--profile-report", report_path])
+        with open(report_path, "rb") as file:
+            report = json.loads(file.read().decode("utf-8"))
+        self.assertEqual(
+            sorted(report["phases"]),
+            ["icons", "nginx", "pages", "preparation", "static"])
+        self.assertEqual(sorted(report["sites"]), ["93z_dev", "93z_py"])
+        self.assertEqual(report["views"]["one_note"]["count"], 11)
+        self.assertLessEqual(
+            {"htmlmin", "mako_render", "pygments", "render_commonmark",
+             "write", "write_background"},
+            set(report["steps"]))
+
+    def test_markdown_cache(self):
+        test_files_dir = os.path.join(testutils.TEST_FILES_DIR, "generator1")
+        temp_dir = self.make_temp_dir()
+        report_path = os.path.join(temp_dir, "report.json")
+
+        def generate():
+            self.generate(
+                src=os.path.join(test_files_dir, "source"), dest=temp_dir,
+                extra_argv=["--profile-report", report_path])
+            self.assert_dirs_equal(
+                os.path.join(temp_dir, "build"),
+                os.path.join(test_files_dir, "build"),
+                ignore_contents=["*.png", "*.ico", "*.atom", "nginx.conf"])
+            with open(report_path, "rb") as file:
+                return json.loads(file.read().decode("utf-8"))
+
+        report = generate()
+        self.assertEqual(report["counters"], {"markdown_misses": 11})
+        report = generate()
+        self.assertEqual(report["counters"], {"markdown_hits": 11})
+        self.assertNotIn("render_commonmark", report["steps"])
+
+    def test_build_with_pagination(self):
+        test_files_dir = os.path.join(testutils.TEST_FILES_DIR, "generator1")
+        temp_dir = self.make_temp_dir()
+        self.generate(
+            src=os.path.join(test_files_dir, "source"), dest=temp_dir,
+            extra_argv=["--features", "pagination", "--notes-per-page", "3"])
+        pages_dir = os.path.join(
+            temp_dir, "build", "sites", "93z_py", "pages")
+
+        def read_page(*segments):
+            path = os.path.join(pages_dir, *(segments + ("index.html", )))
+            with open(path, "rb") as file:
+                return file.read().decode("utf-8")
+
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(pages_dir, "notes", "page"))),
+            ["2", "3"])
+        first_page = read_page("notes")
+        self.assertIn(
+            '<ol class="p-l"><li class="a-o"><span class="a">1</span></li>'
+            '<li><a href="/notes/page/2/">2</a></li>'
+            '<li><a href="/notes/page/3/">3</a></li></ol>', first_page)
+        self.assertEqual(first_page.count('<ol class="n-l">'), 1)
+        last_page = read_page("notes", "page", "3")
+        self.assertIn("<title>Page 3 ← Notes ← py.93z.org</title>", last_page)
+        self.assertIn('<span class="a">3</span>', last_page)
+        # Lists that fit on one page have no links to pages.
+        self.assertNotIn('class="p-l"', read_page("tags", "mako"))
+        self.assertFalse(
+            os.path.exists(os.path.join(pages_dir, "tags", "mako", "page")))
+
+    def test_copied_files_are_linked_from_store(self):
+        temp_dir = self.make_temp_dir()
+        path = os.path.join(
+            temp_dir, "build", "sites", "93z_dev", "pages", "notes",
+            "missing-growl.js-tutorial", "demo", "growl.js")
+        self.check_build_to(temp_dir)
+        stat = os.stat(path)
+        self.assertEqual(stat.st_nlink, 2)
+        self.check_build_to(temp_dir)
+        # File was not copied again.
+        self.assertEqual(os.stat(path).st_ino, stat.st_ino)
+
+    def test_precompress(self):
+        import gzip
+
+        test_files_dir = os.path.join(testutils.TEST_FILES_DIR, "generator1")
+        temp_dir = self.make_temp_dir()
+        src = os.path.join(temp_dir, "source")
+        shutil.copytree(os.path.join(test_files_dir, "source"), src)
+        build_dir = os.path.join(temp_dir, "build")
+        pages_dir = os.path.join(build_dir, "sites", "93z_py", "pages")
+        page_path = os.path.join(pages_dir, "index.html")
+        note_page_path = os.path.join(
+            pages_dir, "notes", "sort-dict-keys-by-values", "index.html")
+
+        def generate(precompress=True):
+            self.generate(
+                src=src, dest=temp_dir,
+                extra_argv=["--incremental"] + (
+                    ["--precompress"] if precompress else []))
+
+        def check_compressed(path):
+            with open(path, "rb") as file:
+                data = file.read()
+            with gzip.open("{}.gz".format(path), "rb") as file:
+                self.assertEqual(file.read(), data)
+
+        # Unchanged pages of previous build are compressed too.
+        generate(precompress=False)
+        generate()
+        check_compressed(page_path)
+        with open(os.path.join(build_dir, "etc", "nginx.conf"), "rb") as file:
+            self.assertIn(b"gzip_static on;", file.read())
+        self.assertFalse(
+            os.path.exists(os.path.join(pages_dir, "robots.txt.gz")))
+        # Unchanged file is not compressed again.
+        mtime = os.stat("{}.gz".format(page_path)).st_mtime_ns
+        generate()
+        self.assertEqual(os.stat("{}.gz".format(page_path)).st_mtime_ns, mtime)
+        # Page changed by build without precompression is compressed again.
+        body_path = os.path.join(
+            src, "nets", "sites", "93z_py", "notes",
+            "2010-08-29-sort-dict-keys-by-values", "body.md")
+        with open(body_path, "ab") as file:
+            file.write(b"\nOne more paragraph.\n")
+        generate(precompress=False)
+        self.assertFalse(os.path.exists("{}.gz".format(note_page_path)))
+        generate()
+        check_compressed(note_page_path)
+
+    def test_fingerprint_static(self):
+        test_files_dir = os.path.join(testutils.TEST_FILES_DIR, "generator1")
+        temp_dir = self.make_temp_dir()
+        build_dir = os.path.join(temp_dir, "build")
+        self.generate(
+            src=os.path.join(test_files_dir, "source"), dest=temp_dir,
+            extra_argv=["--fingerprint-static"])
+        site_build_dir = os.path.join(build_dir, "sites", "93z_py")
+        names = sorted(os.listdir(os.path.join(site_build_dir, "s")))
+        self.assertEqual(len(names), 2)
+        self.assertRegex(names[0], r"^scripts\.[0-9a-f]{16}\.js$")
+        self.assertRegex(names[1], r"^styles\.[0-9a-f]{16}\.css$")
+        path = os.path.join(site_build_dir, "pages", "index.html")
+        with open(path, "rb") as file:
+            page = file.read().decode("utf-8")
+        self.assertIn('href="/s/{}"'.format(names[1]), page)
+        self.assertIn('src="/s/{}"'.format(names[0]), page)
+        with open(os.path.join(build_dir, "etc", "nginx.conf"), "rb") as file:
+            self.assertIn(b"immutable", file.read())
+
+
+class RebuildTest(testutils.TestCase):
+
+    def setUp(self):
+        from unittest import mock
+
+        from paka.vx1 import generator, rendering, writing
+
+        super().setUp()
+        self.generator = generator
+        test_files_dir = os.path.join(testutils.TEST_FILES_DIR, "generator1")
+        temp_dir = self.make_temp_dir()
+        self.src = os.path.join(temp_dir, "source")
+        shutil.copytree(os.path.join(test_files_dir, "source"), self.src)
+        # Configuration of watch mode is made by main.
+        with mock.patch.object(generator, "_watch") as watch:
+            self.generate(
+                src=self.src, dest=temp_dir, extra_argv=["--watch"])
+        self.config = watch.call_args[0][0]
+        self.override_paths = {
+            path: slug
+            for slug, path in (
+                s.split("=", 1) for s in self.config.attr_overrides)}
+        self.writer = writing.make_writer(
+            incremental=True,
+            store_dir=os.path.join(self.config.cache_dir, "files"))
+        self.rendered = []
+        render_to = rendering._Renderer.render_to
+
+        def _render_to(renderer, file, template_name, **kwargs):
+            self.rendered.append((kwargs["site"].slug, kwargs["url_path"]))
+            return render_to(renderer, file, template_name, **kwargs)
+
+        patcher = mock.patch.object(
+            rendering._Renderer, "render_to", _render_to)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def rebuild(self, sites, changed_paths):
+        import io
+        import contextlib
+
+        del self.rendered[:]
+        with contextlib.redirect_stderr(io.StringIO()):
+            new_sites = self.generator._rebuild(
+                list(sites.values()), changed_paths=changed_paths,
+                override_paths=self.override_paths, config=self.config,
+                writer=self.writer)
+        return {site.slug: site for site in new_sites}
+
+    def append(self, path, data):
+        with open(path, "ab") as file:
+            file.write(data)
+
+    def test_rebuild(self):
+        nets_dir = os.path.join(self.src, "nets")
+        sites = self.rebuild({}, changed_paths=None)
+        all_pages = sorted(self.rendered)
+        self.assertEqual(
+            {slug for slug, _ in all_pages}, {"93z_dev", "93z_py"})
+        # Note changed: only its site is read again, only pages that show
+        # note are rendered; build of site that is not built is removed.
+        gone_dir = os.path.join(self.config.build_dir, "sites", "gone")
+        os.makedirs(gone_dir)
+        body_path = os.path.join(
+            nets_dir, "sites", "93z_py", "notes",
+            "2010-08-29-sort-dict-keys-by-values", "body.md")
+        self.append(body_path, b"\nOne more paragraph.\n")
+        new_sites = self.rebuild(sites, changed_paths={body_path})
+        self.assertEqual(
+            sorted(self.rendered),
+            [
+                ("93z_py", "/notes/feed/"),
+                ("93z_py", "/notes/sort-dict-keys-by-values/"),
+                ("93z_py", "/tags/cpython/feed/")])
+        self.assertIs(new_sites["93z_dev"].notes, sites["93z_dev"].notes)
+        self.assertIsNot(new_sites["93z_py"].notes, sites["93z_py"].notes)
+        for slug in ("93z_dev", "93z_py"):
+            self.assertIs(new_sites[slug].renderer, sites[slug].renderer)
+        self.assertFalse(os.path.exists(gone_dir))
+        # Chunk of network changed: sites are not read again, but all their
+        # pages are rendered.
+        sites = new_sites
+        chunk_path = os.path.join(
+            nets_dir, "networks", "samplenet", "long_chunks",
+            "footer_copyrights")
+        self.append(chunk_path, b"<p>More</p>")
+        new_sites = self.rebuild(sites, changed_paths={chunk_path})
+        self.assertEqual(sorted(self.rendered), all_pages)
+        for slug in ("93z_dev", "93z_py"):
+            self.assertIs(new_sites[slug].notes, sites[slug].notes)
+            self.assertIs(new_sites[slug].renderer, sites[slug].renderer)
+        # Template of network changed: sites are read again with new
+        # renderers, all their pages are rendered.
+        sites = new_sites
+        template_path = os.path.join(
+            nets_dir, "networks", "samplenet", "templates", "header.html")
+        self.append(template_path, b"<p>More</p>")
+        new_sites = self.rebuild(sites, changed_paths={template_path})
+        self.assertEqual(sorted(self.rendered), all_pages)
+        for slug in ("93z_dev", "93z_py"):
+            self.assertIsNot(new_sites[slug].notes, sites[slug].notes)
+            self.assertIsNot(new_sites[slug].renderer, sites[slug].renderer)
+        # Nothing changed: nothing is rendered.
+        self.rebuild(new_sites, changed_paths=set())
+        self.assertEqual(self.rendered, [])
+        # Stored copy of changed file is removed from store.
+        substatic_path = os.path.join(
+            nets_dir, "sites", "93z_dev", "notes",
+            "2016-03-18-missing-growl.js-tutorial", "substatic", "demo",
+            "main.js")
+        self.append(substatic_path, b"\n")
+        self.rebuild(new_sites, changed_paths={substatic_path})
+        store_dir = os.path.join(self.config.cache_dir, "files")
+        self.assertEqual(
+            [
+                path for path in testutils.subpaths_rec(store_dir)
+                if os.stat(path).st_nlink < 2],
+            [])
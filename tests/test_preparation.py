@@ -0,0 +1,61 @@
+import os
+import shutil
+import datetime
+
+import testutils
+
+
+class PrepareSitesTest(testutils.TestCase):
+
+    def prepare_sites(self, nets_dir, jobs=1):
+        from paka.vx1.generator import INTERNAL_TEMPLATES_DIR
+        from paka.vx1.preparation import prepare_sites
+        from paka.vx1.utils import subpaths
+
+        src_dir = os.path.join(
+            testutils.TEST_FILES_DIR, "generator1", "source")
+
+        def error_callback(text):
+            raise AssertionError(text)
+
+        sites = prepare_sites(
+            sites_dirs=subpaths(os.path.join(nets_dir, "sites")),
+            networks_dir=os.path.join(nets_dir, "networks"),
+            internal_templates_dir=INTERNAL_TEMPLATES_DIR,
+            prepended_templates_dirs=[], appended_templates_dirs=[],
+            current_date=datetime.date(2017, 1, 17),
+            error_callback=error_callback,
+            attr_overrides=[
+                "{}={}".format(
+                    slug,
+                    os.path.join(src_dir, "{}_attr_overrides".format(slug)))
+                for slug in ("93z_py", "93z_dev")],
+            jobs=jobs)
+        return {site.slug: site for site in sites}
+
+    def test_renderer_is_shared(self):
+        nets_dir = os.path.join(self.make_temp_dir(), "nets")
+        shutil.copytree(
+            os.path.join(
+                testutils.TEST_FILES_DIR, "generator1", "source", "nets"),
+            nets_dir)
+        sites = self.prepare_sites(nets_dir)
+        self.assertIs(sites["93z_py"].renderer, sites["93z_dev"].renderer)
+        # Site with templates of its own has its own renderer.
+        os.mkdir(os.path.join(nets_dir, "sites", "93z_py", "templates"))
+        sites = self.prepare_sites(nets_dir)
+        self.assertIsNot(sites["93z_py"].renderer, sites["93z_dev"].renderer)
+
+    def test_jobs(self):
+        nets_dir = os.path.join(
+            testutils.TEST_FILES_DIR, "generator1", "source", "nets")
+
+        def read(jobs):
+            return {
+                slug: (site.attrs, site.notes, site.tags, site.series)
+                for slug, site in self.prepare_sites(
+                    nets_dir, jobs=jobs).items()}
+
+        serial = read(jobs=1)
+        self.assertTrue(all(notes for _, notes, _, _ in serial.values()))
+        self.assertEqual(read(jobs=3), serial)
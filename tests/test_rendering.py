@@ -0,0 +1,101 @@
+import os
+
+import testutils
+
+
+class RenderTextTest(testutils.TestCase):
+
+    def make_renderer(self, module_directory, minify_fragments=True):
+        from paka.vx1.rendering import make_renderer
+
+        return make_renderer(
+            charset="utf-8", prepended=[], internal=[], appended=[],
+            module_directory=module_directory,
+            minify_fragments=minify_fragments)
+
+    def test_compiled_once(self):
+        module_directory = self.make_temp_dir()
+        renderer = self.make_renderer(module_directory)
+        text = "<p>${name} — ${name}</p>"
+        self.assertEqual(renderer.render_text(text, name="a"), "<p>a — a</p>")
+        text_dir = os.path.join(module_directory, "text")
+        self.assertEqual(
+            sorted(os.path.splitext(name)[1] for name in os.listdir(text_dir)),
+            [".mako", ".py"])
+        for path in testutils.subpaths_rec(text_dir):
+            os.utime(path, ns=(0, 0))
+        self.assertEqual(renderer.render_text(text, name="b"), "<p>b — b</p>")
+        renderer = self.make_renderer(module_directory)
+        self.assertEqual(renderer.render_text(text, name="c"), "<p>c — c</p>")
+        # Compiled module was reused.
+        self.assertEqual(
+            [os.stat(path).st_mtime_ns
+             for path in testutils.subpaths_rec(text_dir)],
+            [0, 0])
+
+    def test_not_minified(self):
+        text = "<p>${name}</p>\n  <p>b</p>\n"
+        renderer = self.make_renderer(None, minify_fragments=False)
+        self.assertEqual(
+            renderer.render_text(text, name="a"), "<p>a</p>\n  <p>b</p>\n")
+        self.assertEqual(
+            renderer.render_markdown("a\n\nb"), "<p>a</p>\n<p>b</p>\n")
+
+
+class HtmlminWriterTest(testutils.TestCase):
+
+    def test_same_as_htmlmin(self):
+        import io
+
+        from paka.webstatic.htmlmin import htmlmin
+
+        from paka.vx1.rendering import _HtmlminWriter
+
+        texts = [
+            "",
+            "  \n<p>a</p>\n  <p> b </p>  <br>\n",
+            "<div>\n<pre> a\n  <b>x</b>\n</pre>\n<p>\n</p><PRE> </PRE>  \n",
+            "<p>a</p>\n <pre class='x'>\n</p>  <p>",
+            " <pre>\n <p>\n",
+            "<pre>a</pre>\n<pre>b</pre> <p> </p>\t<pre> c </pre>"]
+        for text in texts:
+            for block_size, part_size in ((1, 1), (3, 2), (5, 7), (100, 3)):
+                buf = io.StringIO()
+                writer = _HtmlminWriter(buf, block_size=block_size)
+                for start in range(0, len(text), part_size):
+                    writer.write(text[start:start + part_size])
+                writer.close()
+                self.assertEqual(buf.getvalue(), htmlmin(text))
+
+
+class RenderTemplateTest(testutils.TestCase):
+
+    def test_compiled_once(self):
+        from paka.vx1.rendering import make_renderer
+
+        templates_dir = self.make_temp_dir()
+        module_directory = self.make_temp_dir()
+        template_path = os.path.join(templates_dir, "page.html")
+
+        def render(text=None):
+            if text is not None:
+                with open(template_path, "wb") as file:
+                    file.write(text.encode("utf-8"))
+                os.utime(template_path, ns=(0, 0))
+            renderer = make_renderer(
+                charset="utf-8", prepended=[], internal=[templates_dir],
+                appended=[], module_directory=module_directory)
+            return renderer("page.html", name="a")
+
+        lookup_dir = os.path.join(module_directory, "lookup")
+        self.assertEqual(render("<p>${name}</p>"), "<p>a</p>")
+        self.assertEqual(len(os.listdir(lookup_dir)), 1)
+        for path in testutils.subpaths_rec(lookup_dir):
+            os.utime(path, ns=(10 ** 9, 10 ** 9))
+        self.assertEqual(render(), "<p>a</p>")
+        # Compiled module was reused.
+        self.assertEqual(
+            [os.stat(path).st_mtime_ns
+             for path in testutils.subpaths_rec(lookup_dir)],
+            [10 ** 9])
+        self.assertEqual(render("<b>${name}</b>"), "<b>a</b>")
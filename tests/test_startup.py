@@ -0,0 +1,40 @@
+import sys
+import unittest
+import subprocess
+
+import testutils
+
+
+# Microseconds (as reported by "python -X importtime"). Generous, but
+# importing Mako (with Pygments) alone takes about as much.
+IMPORT_TIME_BUDGET = 100000
+HEAVY_MODULES = (
+    "mako", "lxml", "pygments", "paka.cmark", "paka.feedgenerator", "pytz",
+    "paka.webstatic", "multiprocessing")
+
+
+class StartupTest(testutils.TestCase):
+
+    def run_python(self, code):
+        return subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+
+    def test_heavy_modules_are_not_imported(self):
+        result = self.run_python(
+            "import sys, paka.vx1.generator; print(' '.join(sys.modules))")
+        imported = set(result.stdout.decode("utf-8").split())
+        for name in HEAVY_MODULES:
+            self.assertNotIn(name, imported)
+
+    @unittest.skipIf(
+        sys.version_info < (3, 7), "-X importtime requires Python 3.7")
+    def test_import_time(self):
+        result = self.run_python("import paka.vx1.generator")
+        for line in result.stderr.decode("utf-8").splitlines():
+            parts = [part.strip() for part in line.split("|")]
+            if parts[-1] == "paka.vx1.generator":
+                self.assertLess(int(parts[1]), IMPORT_TIME_BUDGET)
+                break
+        else:
+            self.fail("import time of paka.vx1.generator is not reported")
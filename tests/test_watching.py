@@ -0,0 +1,47 @@
+import os
+
+import testutils
+
+
+class SnapshotTest(testutils.TestCase):
+
+    def setUp(self):
+        from paka.vx1 import watching
+
+        super().setUp()
+        self.watching = watching
+
+    def write(self, path, contents):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(contents)
+
+    def test_changed_paths(self):
+        root = self.make_temp_dir()
+        kept_path = os.path.join(root, "a", "kept")
+        modified_path = os.path.join(root, "a", "modified")
+        removed_path = os.path.join(root, "b", "removed")
+        added_path = os.path.join(root, "c", "added")
+        for path in (kept_path, modified_path, removed_path):
+            self.write(path, b"1")
+        old_snapshot = self.watching.take_snapshot([root])
+        self.write(modified_path, b"22")
+        os.remove(removed_path)
+        self.write(added_path, b"1")
+        new_snapshot = self.watching.take_snapshot([root])
+        self.assertEqual(
+            self.watching.get_changed_paths(old_snapshot, new_snapshot),
+            {modified_path, removed_path, added_path})
+
+    def test_file_root(self):
+        root = self.make_temp_dir()
+        path = os.path.join(root, "file")
+        self.write(path, b"1")
+        self.assertEqual(list(self.watching.take_snapshot([path])), [path])
+
+    def test_top_name(self):
+        get_top_name = self.watching.get_top_name
+        self.assertEqual(get_top_name("/x/sites/s1/attrs", "/x/sites"), "s1")
+        self.assertEqual(get_top_name("/x/sites/s1", "/x/sites"), "s1")
+        self.assertIsNone(get_top_name("/x/sites", "/x/sites"))
+        self.assertIsNone(get_top_name("/x/networks/n1", "/x/sites"))
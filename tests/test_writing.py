@@ -0,0 +1,69 @@
+import os
+
+import testutils
+
+
+class WriterTest(testutils.TestCase):
+
+    def test_background_threads(self):
+        from paka.vx1.writing import make_writer
+
+        temp_dir = self.make_temp_dir()
+        writer = make_writer(incremental=False, threads=2)
+        paths = [
+            writer.write(
+                os.path.join(temp_dir, str(i), "index.html"), str(i))
+            for i in range(100)]
+        writer.flush()
+        for i, path in enumerate(paths):
+            with open(path, "rb") as file:
+                self.assertEqual(file.read(), str(i).encode("ascii"))
+
+    def test_background_error_is_raised(self):
+        from paka.vx1.writing import make_writer
+
+        temp_dir = self.make_temp_dir()
+        not_dir_path = os.path.join(temp_dir, "file")
+        with open(not_dir_path, "wb"):
+            pass
+        writer = make_writer(incremental=False, threads=2)
+        with self.assertRaises(OSError):
+            writer.write(os.path.join(not_dir_path, "index.html"), "")
+            writer.flush()
+
+    def test_open(self):
+        from paka.vx1.writing import make_writer
+
+        temp_dir = self.make_temp_dir()
+        path = os.path.join(temp_dir, "a", "index.html")
+        writer = make_writer(incremental=True)
+        mtimes = []
+        for contents in ("a—b", "a—b", "a—c"):
+            with writer.open(path) as file:
+                file.write(contents[:2])
+                file.write(contents[2:])
+            with open(path, "rb") as file:
+                self.assertEqual(file.read(), contents.encode("utf-8"))
+            mtimes.append(os.stat(path).st_mtime_ns)
+            os.utime(path, ns=(0, 0))
+        # File with same contents was left untouched.
+        self.assertEqual(
+            [mtime == 0 for mtime in mtimes], [False, True, False])
+        with self.assertRaises(ValueError):
+            with writer.open(path) as file:
+                file.write("d")
+                raise ValueError
+        self.assertEqual(os.listdir(os.path.dirname(path)), ["index.html"])
+
+    def test_compressed_sibling_older_than_file(self):
+        import gzip
+
+        from paka.vx1.writing import make_writer
+
+        path = os.path.join(self.make_temp_dir(), "index.html")
+        for precompress, contents in ((True, "a"), (False, "b"), (True, "b")):
+            make_writer(incremental=True, precompress=precompress).write(
+                path, contents)
+            os.utime("{}.gz".format(path), ns=(0, 0))
+        with gzip.open("{}.gz".format(path), "rb") as file:
+            self.assertEqual(file.read(), b"b")
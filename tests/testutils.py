@@ -12,6 +12,12 @@ TEST_FILES_DIR = os.path.join(
     os.path.dirname(os.path.abspath(__file__)), "files")
 
 
+def subpaths_rec(base_dir):
+    for dirpath, dirnames, filenames in os.walk(base_dir):
+        for filename in filenames:
+            yield os.path.join(dirpath, filename)
+
+
 class TestCase(unittest.TestCase):
     maxDiff = None
 
@@ -64,7 +70,7 @@ class TestCase(unittest.TestCase):
                     self.assert_text_files_equal(left_path, right_path)
 
     # Generator-specific.
-    def generate(self, src, dest):
+    def generate(self, src, dest, extra_argv=()):
         from paka.vx1.generator import main
 
         nets_dir = os.path.join(src, "nets")
@@ -85,4 +91,5 @@ class TestCase(unittest.TestCase):
             "--template-dirs-prepend", common_dir,
             "--build-dir", build_dir,
             "--cache-dir", cache_dir,
-            "--current-date", "2017-01-17"] + overrides_argv)
+            "--current-date", "2017-01-17"] + overrides_argv +
+            list(extra_argv))